@@ -0,0 +1,50 @@
+"""
+Per-call overhead of the libvlc_* bindings, with and without binding.
+
+    python benchmarks/bench_cfunctions.py [number]
+"""
+import os
+import sys
+import timeit
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, root)
+
+from include import vlc
+
+CALLS = ('get_time', 'is_playing', 'audio_get_volume')
+
+
+def measure(player, number):
+    results = {}
+    for name in CALLS:
+        method = getattr(player, name)
+        best = min(timeit.repeat(method, number=number, repeat=5))
+        results[name] = best / number * 1e9
+    return results
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    instance = vlc.Instance(['--no-audio', '--quiet'])
+    player = instance.media_player_new()
+    player.set_media(instance.media_new(
+        os.path.join(root, 'resources', 'jeopardy.mp3')))
+
+    vlc.set_cfunction_binding(False)
+    wrapped = measure(player, number)
+    vlc.set_cfunction_binding(True)
+    bound = measure(player, number)
+
+    print('%-18s %12s %12s %8s' % ('call', 'wrapper ns', 'bound ns', 'speedup'))
+    for name in CALLS:
+        print('%-18s %12.1f %12.1f %7.2fx' % (
+            name, wrapped[name], bound[name], wrapped[name] / bound[name]))
+
+    player.release()
+    instance.release()
+
+
+if __name__ == '__main__':
+    main()
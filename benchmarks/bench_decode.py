@@ -0,0 +1,35 @@
+"""
+Decoding speed of resources/jeopardy.mp3, paced by the playback clock
+and offline through smem.
+
+    python benchmarks/bench_decode.py [source]
+"""
+import os
+import sys
+import time
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, root)
+
+import soundroom
+
+
+def main():
+    if len(sys.argv) > 1:
+        source = sys.argv[1]
+    else:
+        source = os.path.join(root, 'resources', 'jeopardy.mp3')
+
+    print('%-10s %12s %10s %14s' % ('mode', 'decoded s', 'wall s', 'decoded/wall'))
+    for mode, offline in (('realtime', False), ('offline', True)):
+        start = time.time()
+        samples, rate = soundroom.decode(source, offline=offline)
+        wall = time.time() - start
+        decoded = len(samples) / float(rate)
+        print('%-10s %12.2f %10.2f %13.1fx' % (mode, decoded, wall, decoded / wall))
+
+    soundroom.instances.shutdown()
+
+
+if __name__ == '__main__':
+    main()
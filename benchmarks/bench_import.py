@@ -0,0 +1,54 @@
+"""
+Startup cost of `import soundroom` with lazy and eager libvlc loading.
+
+    python benchmarks/bench_import.py [runs]
+
+"eager" loads libvlc during import, which is what importing soundroom
+used to do. "lazy" is a plain import. "override" also loads the library,
+but from PYTHON_VLC_LIB_PATH, so find_library() is never called.
+"""
+import os
+import subprocess
+import sys
+import time
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+CASES = (
+    ('lazy', 'import soundroom', {}),
+    ('eager', 'import soundroom; soundroom.vlc.load_lib()', {}),
+    ('override', 'import soundroom; soundroom.vlc.load_lib()', None),
+)
+
+
+def run(code, env, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', code], cwd=root, env=env)
+        timings.append(time.time() - start)
+    return min(timings), sum(timings) / len(timings)
+
+
+def resolved_lib_path():
+    code = 'import soundroom; print(soundroom.vlc.load_lib()._name)'
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=root)
+    return out.decode('utf-8').strip()
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    print('%-10s %10s %10s' % ('case', 'min ms', 'mean ms'))
+    for name, code, extra in CASES:
+        env = dict(os.environ)
+        if extra is None:
+            env['PYTHON_VLC_LIB_PATH'] = resolved_lib_path()
+        else:
+            env.update(extra)
+        best, mean = run(code, env, runs)
+        print('%-10s %10.1f %10.1f' % (name, best * 1000, mean * 1000))
+
+
+if __name__ == '__main__':
+    main()
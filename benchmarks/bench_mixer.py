@@ -0,0 +1,58 @@
+"""
+CPU time per voice of N simultaneous sounds, one Player each versus
+one Mixer feeding a single output.
+
+    python benchmarks/bench_mixer.py [source] [seconds]
+"""
+import os
+import sys
+import time
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, root)
+
+import soundroom
+
+
+def players(source, voices, seconds):
+    started = [soundroom.Player(source) for _ in range(voices)]
+    for player in started:
+        player.volume = 100 // voices
+        player.play()
+    time.sleep(seconds)
+    for player in started:
+        player.close()
+
+
+def mixer(source, voices, seconds):
+    with soundroom.Mixer() as mix:
+        for _ in range(voices):
+            mix.add(source, gain=1.0 / voices)
+        time.sleep(seconds)
+
+
+def report(name, func, source, voices, seconds):
+    cpu = time.process_time()
+    func(source, voices, seconds)
+    cpu = time.process_time() - cpu
+    print('%-8s %6d %10.2f s %12.2f %%' % (
+        name, voices, cpu, 100.0 * cpu / seconds / voices))
+
+
+def main():
+    if len(sys.argv) > 1:
+        source = sys.argv[1]
+    else:
+        source = os.path.join(root, 'resources', 'jeopardy.mp3')
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+
+    print('%-8s %6s %12s %14s' % ('mode', 'voices', 'cpu', 'cpu/voice'))
+    for voices in (1, 4, 16):
+        report('players', players, source, voices, seconds)
+        report('mixer', mixer, source, voices, seconds)
+
+    soundroom.instances.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+RSS and open latency of 100 concurrent players on one file, opened by
+path and from a shared memory mapping.
+
+    python benchmarks/bench_mmap.py [players] [source]
+
+Each mode runs in a fresh interpreter so the RSS figures don't mix.
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, root)
+
+import soundroom
+
+INSTANCE_ARGS = ('--aout=dummy', '--no-video', '--quiet')
+
+
+def rss_kb():
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() // 1024
+
+
+def run(source, count, mmap):
+    players = []
+    baseline = rss_kb()
+    start = time.time()
+    for _ in range(count):
+        player = soundroom.Player(source, INSTANCE_ARGS, mmap=mmap)
+        player.play()
+        players.append(player)
+    opened = time.time() - start
+    # Let every player get past opening the input
+    time.sleep(2.0)
+    rss = rss_kb() - baseline
+    for player in players:
+        player.close()
+    soundroom.instances.shutdown()
+    print('%-6s %10.2f ms/player %10d kB RSS' % (
+        'mmap' if mmap else 'path', opened / count * 1000, rss))
+
+
+def main():
+    if len(sys.argv) > 3:
+        run(sys.argv[3], int(sys.argv[1]), sys.argv[2] == 'mmap')
+        return
+
+    count = sys.argv[1] if len(sys.argv) > 1 else '100'
+    if len(sys.argv) > 2:
+        source = sys.argv[2]
+    else:
+        source = os.path.join(root, 'resources', 'jeopardy.mp3')
+    for mode in ('path', 'mmap'):
+        subprocess.check_call(
+            [sys.executable, __file__, count, mode, source])
+
+
+if __name__ == '__main__':
+    main()
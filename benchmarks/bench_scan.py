@@ -0,0 +1,65 @@
+"""
+Metadata scanning throughput, serial Media.parse() loop versus scan()
+at several concurrency levels, in process and across worker processes.
+
+    python benchmarks/bench_scan.py [directory | file] [count]
+
+Without a directory, the bundled jeopardy.mp3 is scanned `count` times.
+"""
+import os
+import sys
+import time
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, root)
+
+import soundroom
+
+
+def collect(target, count):
+    if os.path.isdir(target):
+        return [os.path.join(dirpath, name)
+                for dirpath, _, names in os.walk(target) for name in names]
+    return [target] * count
+
+
+def serial(sources):
+    instance = soundroom.instances.acquire()
+    for source in sources:
+        media = instance.media_new(source)
+        media.parse()
+        soundroom.media_metadata(media)
+        media.release()
+    soundroom.instances.release()
+
+
+def concurrent(sources, concurrency, processes=None):
+    for _ in soundroom.scan(sources, concurrency=concurrency,
+                            processes=processes):
+        pass
+
+
+def report(name, sources, func, *args):
+    start = time.time()
+    func(sources, *args)
+    elapsed = time.time() - start
+    print('%-14s %10.2f s %12.1f files/s' % (name, elapsed, len(sources) / elapsed))
+
+
+def main():
+    target = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        root, 'resources', 'jeopardy.mp3')
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    sources = collect(target, count)
+
+    report('serial', sources, serial)
+    for concurrency in (1, 4, 16, 64):
+        report('scan x%d' % concurrency, sources, concurrent, concurrency)
+    for processes in (2, 4, os.cpu_count()):
+        report('procs %d x16' % processes, sources, concurrent, 16, processes)
+
+    soundroom.instances.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -44,9 +44,13 @@ from ctypes.util import find_library
 import os
 import sys
 import functools
+import threading
 
 # Used by EventManager in override.py
-from inspect import getargspec
+try:
+    from inspect import getargspec
+except ImportError:  # removed in Python 3.11
+    from inspect import getfullargspec as getargspec
 
 __version__ = "N/A"
 build_date  = "Thu Nov  5 23:41:43 2015"
@@ -103,9 +107,20 @@ else:
 # instanciated.
 _internal_guard = object()
 
-def find_lib():
+def find_lib(path=None, plugin_path=None):
+    """Locate and load libvlc, returning (dll, plugin_path).
+
+    An explicit library path, or the PYTHON_VLC_LIB_PATH environment
+    variable, skips the platform lookup (and find_library) entirely.
+    PYTHON_VLC_MODULE_PATH likewise sets the plugin path.
+    """
     dll = None
-    plugin_path = None
+    if path is None:
+        path = os.environ.get('PYTHON_VLC_LIB_PATH')
+    if plugin_path is None:
+        plugin_path = os.environ.get('PYTHON_VLC_MODULE_PATH')
+    if path:
+        return (ctypes.CDLL(path), plugin_path)
     if sys.platform.startswith('linux'):
         p = find_library('vlc')
         try:
@@ -169,8 +184,30 @@ def find_lib():
 
     return (dll, plugin_path)
 
-# plugin_path used on win32 and MacOS in override.py
-dll, plugin_path  = find_lib()
+# plugin_path used on win32 and MacOS in override.py.  Looking the
+# library up may spawn subprocesses, so it is deferred until the first
+# libvlc function or Instance is needed, see load_lib().
+dll = None
+plugin_path = None
+_lib_lock = threading.Lock()
+
+def load_lib(path=None, module_path=None):
+    """Load libvlc now, optionally from an explicit path.
+
+    This normally happens on first use.  It has no effect once the
+    library has been loaded.
+    @param path: path of the libvlc shared library.
+    @param module_path: path of the VLC plugins directory.
+    @return: the ctypes library.
+    """
+    global dll, plugin_path
+    if dll is None:
+        with _lib_lock:
+            if dll is None:
+                d, plugin_path = find_lib(path, module_path)
+                _load_libvlc_free(d)
+                dll = d
+    return dll
 
 class VLCException(Exception):
     """Exception raised by libvlc methods.
@@ -230,6 +267,7 @@ _Globals = globals()  # sys.modules[__name__].__dict__
 def _Cfunction(name, flags, errcheck, *types):
     """(INTERNAL) New ctypes function binding.
     """
+    dll = load_lib()
     if hasattr(dll, name) and name in _Globals:
         p = ctypes.CFUNCTYPE(*types)
         f = p((name, dll), flags)
@@ -237,14 +275,38 @@ def _Cfunction(name, flags, errcheck, *types):
             f.errcheck = errcheck
         # replace the Python function
         # in this module, but only when
-        # running as python -O or -OO
-        if __debug__:
-            _Cfunctions[name] = f
-        else:
+        # running as python -O or -OO or
+        # when binding has been enabled
+        _Cfunctions[name] = f
+        if _Cbind:
+            _Cwrappers.setdefault(name, _Globals[name])
             _Globals[name] = f
         return f
     raise NameError('no function %r' % (name,))
 
+_Cbind = not __debug__
+_Cwrappers = {}  # replaced Python functions
+
+def set_cfunction_binding(enabled=True):
+    """Replace the libvlc_* Python wrappers with their ctypes functions.
+
+    Each wrapper looks its ctypes function up in a dict on every call.
+    With binding enabled, the module-level wrapper is replaced by the
+    bound ctypes function the first time it is used (and immediately
+    for functions already resolved), so later calls go straight to
+    ctypes. This is always the case when running as python -O or -OO.
+    Disabling binding restores the original Python wrappers.
+    """
+    global _Cbind
+    _Cbind = bool(enabled)
+    if _Cbind:
+        for name, f in _Cfunctions.items():
+            _Cwrappers.setdefault(name, _Globals[name])
+            _Globals[name] = f
+    else:
+        _Globals.update(_Cwrappers)
+        _Cwrappers.clear()
+
 def _Cobject(cls, ctype):
     """(INTERNAL) New instance from ctypes.
     """
@@ -1542,6 +1604,7 @@ class Instance(_Ctype):
             else:
                 raise VLCException('Instance %r' % (args,))
 
+        load_lib()
         if not args and plugin_path is not None:
              # no parameters passed, for win32 and MacOS,
              # specify the plugin_path if detected earlier
@@ -6981,7 +7044,12 @@ def callbackmethod(callback):
 
 # libvlc_free is not present in some versions of libvlc. If it is not
 # in the library, then emulate it by calling libc.free
-if not hasattr(dll, 'libvlc_free'):
+def _load_libvlc_free(dll):
+    """(INTERNAL) Install the libc.free fallback once libvlc is loaded.
+    """
+    global libvlc_free
+    if hasattr(dll, 'libvlc_free'):
+        return
     # need to find the free function in the C runtime. This is
     # platform specific.
     # For Linux and MacOSX
@@ -1,9 +1,32 @@
 import os
+import sys
+import json
+import hashlib
+import math
+import heapq
+import mmap
+import struct
 import time
+import queue
+import itertools
+import logging
+import threading
+import weakref
+from collections import deque, namedtuple
 from ctypes import *
 
 from include import vlc
 
+# numpy, only needed to access decoded samples, is imported on first use
+# by _require_numpy(). It costs more than the rest of the import
+np = None
+
+# Position and volume polling goes through the libvlc_* wrappers, skip
+# their per-call function lookup
+vlc.set_cfunction_binding(True)
+
+log = logging.getLogger(__name__)
+
 """
 Notable audio packages
 ----------------------
@@ -43,80 +66,1110 @@ What libvlc provides
 - Read encoded audio (MP3, etc.)
 - Play directly from url / stream
 - Full, stable media controls
+- Load audio as samples (through the audio callbacks, requires numpy)
 
 What libvlc can't do
 --------------------
 
 - Record audio
-- Load audio as samples / export samples
+- Export samples
 - Convert file formats
 """
 
 
+LogEntry = namedtuple('LogEntry', ['time', 'level', 'message'])
+
+# Raw pointers only, so ctypes does no conversion before the level check
+_LogCallback = CFUNCTYPE(None, c_void_p, c_int, c_void_p, c_void_p, c_void_p)
+
+_vsnprintf = None
+
+
+def _libc_vsnprintf():
+    global _vsnprintf
+    if _vsnprintf is None:
+        if os.name == 'nt':
+            func = cdll.msvcrt._vsnprintf
+        else:
+            # libc is already loaded, no find_library() and its subprocesses
+            func = CDLL(None).vsnprintf
+        func.argtypes = [c_char_p, c_size_t, c_void_p, c_void_p]
+        func.restype = c_int
+        _vsnprintf = func
+    return _vsnprintf
+
+
+class LogSink(object):
+    """
+    Receives libvlc log messages for any number of instances.
+
+    Messages below the sink's vlc.LogLevel are discarded on entry, before
+    anything is converted or formatted, and a sink with level None is never
+    installed at all. The format string is expanded with the C library's
+    vsnprintf() and the message is sent to a logging.Logger, appended to a
+    bounded in-memory ring buffer of LogEntry tuples, or both.
+    """
+
+    LEVELS = {
+        vlc.LogLevel.DEBUG.value: logging.DEBUG,
+        vlc.LogLevel.NOTICE.value: logging.INFO,
+        vlc.LogLevel.WARNING.value: logging.WARNING,
+        vlc.LogLevel.ERROR.value: logging.ERROR,
+    }
+
+    BUFFER_SIZE = 1024
+
+    def __init__(self, level=vlc.LogLevel.WARNING, logger=None,
+                 buffer_size=None):
+        self.level = level
+        if logger is None and not buffer_size:
+            logger = logging.getLogger(__name__ + '.vlc')
+        self.logger = logger
+        self.buffer = deque(maxlen=buffer_size) if buffer_size else None
+        self._local = threading.local()
+        self._callback = _LogCallback(self._handle)
+
+    @property
+    def level(self):
+        return self._level
+
+    @level.setter
+    def level(self, val):
+        self._level = val
+        # Plain int for the comparison in the native callback
+        self._threshold = None if val is None else int(getattr(val, 'value', val))
+
+    def attach(self, instance):
+        if self._threshold is not None:
+            # Resolved here rather than in the first callback, on libvlc's thread
+            _libc_vsnprintf()
+            vlc.libvlc_log_set(instance, self._callback, None)
+
+    def format(self, fmt, args):
+        buf = getattr(self._local, 'buf', None)
+        if buf is None:
+            buf = self._local.buf = create_string_buffer(self.BUFFER_SIZE)
+        # The va_list can only be consumed once, longer messages are truncated
+        _libc_vsnprintf()(buf, sizeof(buf), fmt, args)
+        return buf.value.decode('utf-8', 'replace')
+
+    def _handle(self, data, level, ctx, fmt, args):
+        threshold = self._threshold
+        if threshold is None or level < threshold:
+            return
+        message = self.format(fmt, args)
+        if self.buffer is not None:
+            self.buffer.append(LogEntry(time.time(), level, message))
+        if self.logger is not None:
+            self.logger.log(self.LEVELS.get(level, logging.ERROR), '%s', message)
+
+
+class InstanceManager(object):
+    """
+    Process-wide registry of vlc.Instance objects keyed by argument list.
+
+    Creating an instance runs libvlc_new() and loads the whole plugin cache,
+    so every player created with the same arguments shares one instance.
+    Instances are reference counted but stay alive while idle, because
+    short-lived players would otherwise pay the full startup cost again.
+    Call shutdown() to release them explicitly.
+
+    libvlc log messages of every instance go to a single LogSink.
+    """
+
+    def __init__(self, log_sink=None):
+        self.log_sink = log_sink or LogSink()
+        self._lock = threading.Lock()
+        self._instances = {}
+        self._refcounts = {}
+
+    @staticmethod
+    def key(args=()):
+        if isinstance(args, str):
+            args = args.strip().split()
+        return tuple(args)
+
+    def acquire(self, args=()):
+        key = self.key(args)
+        with self._lock:
+            instance = self._instances.get(key)
+            if instance is None:
+                instance = self._create(key)
+                self._instances[key] = instance
+                self._refcounts[key] = 0
+            self._refcounts[key] += 1
+            return instance
+
+    def release(self, args=()):
+        key = self.key(args)
+        with self._lock:
+            if self._refcounts.get(key, 0) > 0:
+                self._refcounts[key] -= 1
+
+    def refcount(self, args=()):
+        with self._lock:
+            return self._refcounts.get(self.key(args), 0)
+
+    def shutdown(self):
+        with self._lock:
+            instances = list(self._instances.values())
+            self._instances.clear()
+            self._refcounts.clear()
+        for instance in instances:
+            instance.release()
+
+    def _create(self, key):
+        instance = vlc.Instance(list(key))
+        self.log_sink.attach(instance)
+        return instance
+
+
+instances = InstanceManager()
+
+
+EventRecord = namedtuple('EventRecord', ['type', 'value'])
+
+EventType = vlc.EventType
+
+# Union field of vlc.Event carrying the payload of each event type
+EVENT_FIELDS = {
+    EventType.MediaMetaChanged.value: 'meta_type',
+    EventType.MediaDurationChanged.value: 'new_duration',
+    EventType.MediaParsedChanged.value: 'new_status',
+    EventType.MediaStateChanged.value: 'new_state',
+    EventType.MediaPlayerBuffering.value: 'new_cache',
+    EventType.MediaPlayerTimeChanged.value: 'new_time',
+    EventType.MediaPlayerPositionChanged.value: 'new_position',
+    EventType.MediaPlayerSeekableChanged.value: 'new_seekable',
+    EventType.MediaPlayerPausableChanged.value: 'new_pausable',
+    EventType.MediaPlayerTitleChanged.value: 'new_title',
+    EventType.MediaPlayerLengthChanged.value: 'new_length',
+    EventType.MediaPlayerVout.value: 'new_count',
+    EventType.MediaPlayerScrambledChanged.value: 'new_scrambled',
+    EventType.MediaListPlayerNextItemSet.value: 'media',
+}
+
+_EventCallback = CFUNCTYPE(None, POINTER(vlc.Event), c_void_p)
+
+
+def event_record(event):
+    """
+    Copy the type and payload out of a vlc.Event, which is only valid for
+    the duration of the native callback.
+    """
+    field = EVENT_FIELDS.get(event.type.value)
+    value = getattr(event.u, field) if field else None
+    # event.type shares the native struct's memory, copy the value
+    return EventRecord(EventType(event.type.value), value)
+
+
+class EventDispatcher(object):
+    """
+    Runs event subscribers on a dedicated worker thread.
+
+    Subscribers called from the native handler run on libvlc's event thread
+    and a slow one stalls it. A hub with a dispatcher only appends the event
+    record to a bounded queue, which the worker drains. When the queue is
+    full the record is dropped ('drop') or the oldest queued record is
+    dropped instead ('drop_oldest'). With 'coalesce', a high-frequency
+    event always supersedes the record still queued for the same hub and
+    event type, and is queued behind everything posted before it. Other
+    records are dropped when the queue is full.
+    """
+
+    POLICIES = ('drop', 'drop_oldest', 'coalesce')
+
+    COALESCED_EVENTS = frozenset([
+        EventType.MediaPlayerBuffering.value,
+        EventType.MediaPlayerTimeChanged.value,
+        EventType.MediaPlayerPositionChanged.value,
+        EventType.MediaPlayerAudioVolume.value,
+    ])
+
+    def __init__(self, maxsize=1024, policy='coalesce'):
+        if policy not in self.POLICIES:
+            raise ValueError('Unknown overflow policy %r' % policy)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.enqueued = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.high_water = 0
+
+        self._queue = deque()
+        # (hub, event type) -> queued item, for coalescing. Superseded items
+        # stay in the queue, marked stale, until the worker skips them
+        self._latest = {}
+        self._stale = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name='soundroom-events')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._queue) - self._stale
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._queue) - self._stale,
+                'enqueued': self.enqueued,
+                'dispatched': self.dispatched,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                'high_water': self.high_water,
+            }
+
+    def put(self, hub, k, record, subscribers):
+        with self._cond:
+            if self._closed:
+                return
+            key = (id(hub), k)
+            coalesce = self.policy == 'coalesce' and k in self.COALESCED_EVENTS
+            stale = self._latest.get(key) if coalesce else None
+            if stale is not None:
+                # Keep the order of events, the new record goes to the back
+                stale[3] = True
+                self._stale += 1
+                self.coalesced += 1
+            elif len(self) >= self.maxsize:
+                if self.policy != 'drop_oldest':
+                    self.dropped += 1
+                    return
+                self._pop()
+                self.dropped += 1
+            item = [key, record, subscribers, False]
+            self._queue.append(item)
+            if k in self.COALESCED_EVENTS:
+                self._latest[key] = item
+            if stale is None:
+                self.enqueued += 1
+            self.high_water = max(self.high_water, len(self))
+            self._cond.notify()
+
+    def close(self, timeout=None):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _pop(self):
+        # Oldest live item, skipping superseded ones
+        while True:
+            item = self._queue.popleft()
+            if item[3]:
+                self._stale -= 1
+                continue
+            if self._latest.get(item[0]) is item:
+                del self._latest[item[0]]
+            return item
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not len(self) and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                item = self._pop()
+                self.dispatched += 1
+            EventHub.dispatch(item[1], item[2])
+
+
+class _CoalescedSlot(object):
+    """
+    Latest event record of one coalesced subscription. The hub calls it from
+    the native handler, which only stores the record.
+    """
+
+    __slots__ = ('record', 'dirty', 'callback', 'args', 'kwds', 'coalescer')
+
+    def __init__(self, coalescer, callback, args, kwds):
+        self.record = None
+        self.dirty = False
+        self.coalescer = coalescer
+        self.callback = callback
+        self.args = args
+        self.kwds = kwds
+
+    def __call__(self, record):
+        self.record = record
+        self.dirty = True
+
+    def flush(self):
+        if self.dirty:
+            self.dirty = False
+            self.callback(self.record, *self.args, **self.kwds)
+
+
+class Coalescer(object):
+    """
+    Delivers the latest value of high-frequency events at most once per
+    interval, for every subscription registered with it, from one thread.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._slots = ()
+        self._cond = threading.Condition(threading.Lock())
+        self._thread = threading.Thread(
+            target=self._run, name='soundroom-coalesce-%g' % interval)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, slot):
+        with self._cond:
+            self._slots += (slot,)
+            self._cond.notify()
+
+    def remove(self, slot):
+        with self._cond:
+            self._slots = tuple(s for s in self._slots if s is not slot)
+
+    def _run(self):
+        deadline = time.monotonic()
+        while True:
+            with self._cond:
+                while not self._slots:
+                    self._cond.wait()
+                    deadline = time.monotonic()
+                slots = self._slots
+            for slot in slots:
+                try:
+                    slot.flush()
+                except Exception:
+                    log.exception('Error in coalesced subscriber')
+            # Fixed deadlines keep the cadence steady whatever the flush cost
+            deadline += self.interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.monotonic()
+
+
+_coalescers = {}
+
+
+def coalescer(interval):
+    """Return the Coalescer shared by all subscriptions with this interval."""
+    with _hub_lock:
+        if interval not in _coalescers:
+            _coalescers[interval] = Coalescer(interval)
+        return _coalescers[interval]
+
+
+_default_dispatcher = None
+
+
+def default_dispatcher():
+    """Return the EventDispatcher shared by players created with dispatcher=True."""
+    global _default_dispatcher
+    with _hub_lock:
+        if _default_dispatcher is None:
+            _default_dispatcher = EventDispatcher()
+        return _default_dispatcher
+
+
+class EventHub(object):
+    """
+    Fans libvlc events out to any number of Python subscribers.
+
+    vlc.EventManager keeps a single callback per event type. The hub instead
+    attaches one native handler per event type the first time it is
+    subscribed to and forwards each event to every subscriber, so adding a
+    listener never costs another native registration. Subscribers are called
+    with an EventRecord followed by the extra arguments given to subscribe().
+    They run on libvlc's event thread unless the hub has a dispatcher.
+    """
+
+    def __init__(self, event_manager, dispatcher=None):
+        self.dispatcher = dispatcher
+        self._event_manager = event_manager
+        self._lock = threading.Lock()
+        # Event type -> tuple of subscriptions, replaced on every change so
+        # the native handler can iterate it without taking the lock
+        self._subscribers = {}
+        self._handler = _EventCallback(self._handle)
+
+    def subscribe(self, eventtype, callback, *args, **kwds):
+        """
+        Call callback(record, *args, **kwds) for every event of this type.
+        Returns a token to pass to unsubscribe().
+        """
+        k = eventtype.value
+        token = (k, callback, args, kwds)
+        with self._lock:
+            subscribers = self._subscribers.get(k)
+            if subscribers is None:
+                self._attach(k)
+                subscribers = ()
+            self._subscribers[k] = subscribers + (token,)
+        return token
+
+    def subscribe_coalesced(self, eventtype, callback, interval=0.1,
+                            *args, **kwds):
+        """
+        Like subscribe(), but callback only sees the latest record, at most
+        once every interval seconds, from the coalescer's thread.
+        """
+        slot = _CoalescedSlot(coalescer(interval), callback, args, kwds)
+        token = self.subscribe(eventtype, slot)
+        slot.coalescer.add(slot)
+        return token
+
+    def unsubscribe(self, token):
+        k, callback = token[:2]
+        if isinstance(callback, _CoalescedSlot):
+            callback.coalescer.remove(callback)
+        with self._lock:
+            subscribers = self._subscribers.get(k, ())
+            remaining = tuple(t for t in subscribers if t is not token)
+            if len(remaining) == len(subscribers):
+                return
+            if remaining:
+                self._subscribers[k] = remaining
+            else:
+                del self._subscribers[k]
+                self._detach(k)
+
+    def clear(self):
+        with self._lock:
+            for k, subscribers in list(self._subscribers.items()):
+                for _, callback, _, _ in subscribers:
+                    if isinstance(callback, _CoalescedSlot):
+                        callback.coalescer.remove(callback)
+                del self._subscribers[k]
+                self._detach(k)
+
+    def subscriber_count(self, eventtype):
+        return len(self._subscribers.get(eventtype.value, ()))
+
+    def _attach(self, k):
+        if vlc.libvlc_event_attach(self._event_manager, k, self._handler, k):
+            raise vlc.VLCException('Could not attach to %s' % EventType(k))
+
+    def _detach(self, k):
+        vlc.libvlc_event_detach(self._event_manager, k, self._handler, k)
+
+    def _handle(self, event, k):
+        # The event type doubles as the user data, NULL arrives as None
+        k = k or 0
+        subscribers = self._subscribers.get(k)
+        if not subscribers:
+            return
+        record = event_record(event.contents)
+        dispatcher = self.dispatcher
+        if dispatcher is not None:
+            dispatcher.put(self, k, record, subscribers)
+        else:
+            self.dispatch(record, subscribers)
+
+    @staticmethod
+    def dispatch(record, subscribers):
+        for _, callback, args, kwds in subscribers:
+            try:
+                callback(record, *args, **kwds)
+            except Exception:
+                log.exception('Error in %s subscriber', record.type)
+
+
+_hub_lock = threading.Lock()
+
+
+# The event_manager() methods of the bindings memoize their result in a
+# class-level dict that is never cleared, which would keep every object
+# given a hub alive forever, so the libvlc functions are called directly
+_EVENT_MANAGERS = (
+    (vlc.MediaPlayer, vlc.libvlc_media_player_event_manager),
+    (vlc.Media, vlc.libvlc_media_event_manager),
+    (vlc.MediaList, vlc.libvlc_media_list_event_manager),
+    (vlc.MediaListPlayer, vlc.libvlc_media_list_player_event_manager),
+)
+
+
+def event_manager(obj):
+    """Return the vlc.EventManager of a vlc object, without caching it."""
+    for cls, func in _EVENT_MANAGERS:
+        if isinstance(obj, cls):
+            return func(obj)
+    return obj.event_manager()
+
+
+def event_hub(obj):
+    """
+    Return the EventHub shared by every user of a vlc object that has an
+    event manager (MediaPlayer, Media, MediaList, MediaListPlayer).
+    """
+    hub = getattr(obj, '_event_hub', None)
+    if hub is None:
+        with _hub_lock:
+            hub = getattr(obj, '_event_hub', None)
+            if hub is None:
+                hub = obj._event_hub = EventHub(event_manager(obj))
+    return hub
+
+
+# Prototypes for libvlc_media_new_callbacks(), the generated ones in vlc.py
+# have pointer return types that ctypes refuses for callbacks
+_MediaOpenCb = CFUNCTYPE(c_int, c_void_p, POINTER(c_void_p), POINTER(c_uint64))
+_MediaReadCb = CFUNCTYPE(c_ssize_t, c_void_p, c_void_p, c_size_t)
+_MediaSeekCb = CFUNCTYPE(c_int, c_void_p, c_uint64)
+_MediaCloseCb = CFUNCTYPE(None, c_void_p)
+
+_UNKNOWN_SIZE = 2 ** 64 - 1
+
+# Opaque pointer -> source, and -> (source, open stream). Ids are never 0,
+# which libvlc passes back as None. Sources are only held weakly, so one
+# that is never closed goes away with its media and player
+_callback_ids = itertools.count(1)
+_callback_sources = weakref.WeakValueDictionary()
+_callback_streams = {}
+
+
+@_MediaOpenCb
+def _media_open(opaque, datap, sizep):
+    try:
+        source = _callback_sources[opaque]
+        stream = source.open()
+        key = next(_callback_ids)
+        # The stream keeps its source, and the memory it reads, alive
+        _callback_streams[key] = (source, stream)
+        datap[0] = key
+        sizep[0] = _UNKNOWN_SIZE if source.size is None else source.size
+        return 0
+    except Exception:
+        log.exception('Could not open %r', _callback_sources.get(opaque))
+        return -1
+
+
+@_MediaReadCb
+def _media_read(opaque, buf, length):
+    try:
+        return _callback_streams[opaque][1].read(buf, length)
+    except Exception:
+        log.exception('Could not read media')
+        return -1
+
+
+@_MediaSeekCb
+def _media_seek(opaque, offset):
+    try:
+        return _callback_streams[opaque][1].seek(offset)
+    except Exception:
+        log.exception('Could not seek media')
+        return -1
+
+
+@_MediaCloseCb
+def _media_close(opaque):
+    item = _callback_streams.pop(opaque, None)
+    if item is not None:
+        item[1].close()
+
+
+class CallbackSource(object):
+    """
+    Media source served to libvlc through libvlc_media_new_callbacks().
+
+    Subclasses set `size` (None when unknown) and `seekable`, and implement
+    open(), returning a stream with read(address, length), seek(offset) and
+    close(). Every player opening the media gets its own stream, and may
+    open it again after being stopped. The source must stay registered,
+    that is not be closed, until every player using the media has been
+    stopped. The media keeps a reference to it.
+    """
+
+    size = None
+    seekable = True
+
+    def __init__(self):
+        self._key = next(_callback_ids)
+        _callback_sources[self._key] = self
+
+    def media_new(self, instance, *options):
+        media = instance.media_new_callbacks(
+            _media_open, _media_read,
+            _media_seek if self.seekable else None,
+            _media_close, self._key)
+        if media is None:
+            raise ValueError('Could not open source')
+        for option in options:
+            media.add_option(option)
+        media._instance = instance
+        media._callback_source = self
+        return media
+
+    def open(self):
+        raise NotImplementedError
+
+    def close(self):
+        _callback_sources.pop(self._key, None)
+
+
+def buffer_address(obj):
+    """
+    Return (address, nbytes, owner) for a C-contiguous buffer without
+    copying it, where owner must be kept alive while the address is used.
+    """
+    view = memoryview(obj)
+    if not view.c_contiguous:
+        raise ValueError('Buffer must be C-contiguous')
+    view = view.cast('B')
+    if not view.readonly:
+        array = (c_char * view.nbytes).from_buffer(view)
+        return addressof(array), view.nbytes, array
+    if isinstance(obj, bytes):
+        return cast(c_char_p(obj), c_void_p).value, len(obj), obj
+    numpy = sys.modules.get('numpy')
+    if numpy is not None:
+        array = numpy.frombuffer(view, numpy.uint8)
+        return array.ctypes.data, view.nbytes, array
+    # Read-only buffer that can't be addressed without numpy
+    data = view.tobytes()
+    return cast(c_char_p(data), c_void_p).value, len(data), data
+
+
+class MemorySource(CallbackSource):
+    """
+    Serves one or more in-memory buffers back to back, copying straight
+    from them into libvlc's read buffer.
+    """
+
+    def __init__(self, *buffers):
+        CallbackSource.__init__(self)
+        self._segments = []
+        self._owners = []
+        offset = 0
+        for buf in buffers:
+            address, nbytes, owner = buffer_address(buf)
+            self._segments.append((offset, address, nbytes))
+            self._owners.append(owner)
+            offset += nbytes
+        self.size = offset
+
+    def open(self):
+        return _MemoryStream(self._segments, self.size)
+
+
+class _MemoryStream(object):
+
+    def __init__(self, segments, size):
+        self._segments = segments
+        self._size = size
+        self._pos = 0
+
+    def read(self, buf, length):
+        done = 0
+        pos = self._pos
+        for start, address, nbytes in self._segments:
+            if done == length or pos >= self._size:
+                break
+            if pos >= start + nbytes:
+                continue
+            count = min(length - done, start + nbytes - pos)
+            memmove(buf + done, address + pos - start, count)
+            done += count
+            pos += count
+        self._pos = pos
+        return done
+
+    def seek(self, offset):
+        if offset > self._size:
+            return -1
+        self._pos = offset
+        return 0
+
+    def close(self):
+        pass
+
+
+# numpy dtype -> WAV format tag
+WAV_FORMATS = {
+    'int16': 1,
+    'int32': 1,
+    'float32': 3,
+}
+
+
+def wav_header(frames, samplerate, channels, dtype):
+    """Return the RIFF/WAVE header for interleaved little-endian samples."""
+    tag = WAV_FORMATS[dtype.name]
+    width = dtype.itemsize
+    data_size = frames * channels * width
+    if tag == 1:
+        fmt = struct.pack('<HHIIHH', tag, channels, samplerate,
+                          samplerate * channels * width, channels * width,
+                          width * 8)
+        extra = b''
+    else:
+        # Non-PCM formats carry a cbSize field and a fact chunk
+        fmt = struct.pack('<HHIIHHH', tag, channels, samplerate,
+                          samplerate * channels * width, channels * width,
+                          width * 8, 0)
+        extra = b'fact' + struct.pack('<II', 4, frames)
+    chunks = (b'fmt ' + struct.pack('<I', len(fmt)) + fmt + extra +
+              b'data' + struct.pack('<I', data_size))
+    return b'RIFF' + struct.pack('<I', 4 + len(chunks) + data_size) + b'WAVE' + chunks
+
+
+class SamplesSource(MemorySource):
+    """
+    Serves an array of samples, shaped (frames,) or (frames, channels), as
+    a WAV stream: a synthesized header followed by the array's own memory.
+
+    int16, int32 and float32 arrays in native little-endian C order are
+    served without a copy. Anything else is converted first.
+    """
+
+    def __init__(self, samples, samplerate):
+        _require_numpy()
+        samples = np.asarray(samples)
+        if samples.ndim == 1:
+            samples = samples[:, np.newaxis]
+        if samples.ndim != 2:
+            raise ValueError('Samples must be shaped (frames, channels)')
+        dtype = samples.dtype
+        if dtype.name not in WAV_FORMATS:
+            dtype = np.dtype('float32')
+        samples = np.ascontiguousarray(samples, dtype.newbyteorder('<'))
+        frames, channels = samples.shape
+        header = wav_header(frames, int(samplerate), channels, samples.dtype)
+        MemorySource.__init__(self, header, samples)
+
+
+class _Mapping(object):
+    """Read-only view of a whole file shared by every MappedSource on it."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            # A private mapping is writable from Python, which ctypes needs
+            # to take its address, but pages stay shared with the page
+            # cache as nothing ever writes to them
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        self.array = (c_char * len(self.mmap)).from_buffer(self.mmap)
+        self.address = addressof(self.array)
+        self.size = len(self.mmap)
+        self.refcount = 0
+
+    def close(self):
+        del self.array
+        self.mmap.close()
+
+
+_mappings = {}
+_mapping_lock = threading.Lock()
+
+
+class MappedSource(MemorySource):
+    """
+    Serves a local file from a memory mapping. The file is mapped once per
+    (path, size, mtime) and shared by every source opened on it, so any
+    number of players use a single mapping and no file handles.
+    """
+
+    def __init__(self, path):
+        CallbackSource.__init__(self)
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        if not stat.st_size:
+            raise ValueError('Can not map empty file %s' % path)
+        self._mapping_key = (path, stat.st_size, stat.st_mtime)
+        with _mapping_lock:
+            mapping = _mappings.get(self._mapping_key)
+            if mapping is None:
+                mapping = _mappings[self._mapping_key] = _Mapping(path)
+            mapping.refcount += 1
+        self._mapping = mapping
+        self._segments = [(0, mapping.address, mapping.size)]
+        self.size = mapping.size
+
+    def close(self):
+        CallbackSource.close(self)
+        with _mapping_lock:
+            mapping, self._mapping = self._mapping, None
+            if mapping is None:
+                return
+            mapping.refcount -= 1
+            if mapping.refcount:
+                return
+            del _mappings[self._mapping_key]
+        mapping.close()
+
+
+class FileSource(CallbackSource):
+    """
+    Serves a file-like object opened in binary mode, reading straight into
+    libvlc's buffer with readinto() when it is available. Unseekable files
+    are played as streams of unknown size.
+    """
+
+    def __init__(self, fileobj):
+        CallbackSource.__init__(self)
+        self._file = fileobj
+        seekable = getattr(fileobj, 'seekable', None)
+        self.seekable = bool(seekable()) if seekable else hasattr(fileobj, 'seek')
+        if self.seekable:
+            try:
+                self.size = os.fstat(fileobj.fileno()).st_size
+            except (AttributeError, OSError, ValueError):
+                pos = fileobj.tell()
+                self.size = fileobj.seek(0, os.SEEK_END)
+                fileobj.seek(pos)
+
+    def open(self):
+        if self.seekable:
+            self._file.seek(0)
+        return _FileStream(self._file)
+
+
+class _FileStream(object):
+
+    def __init__(self, fileobj):
+        self._file = fileobj
+
+    def read(self, buf, length):
+        readinto = getattr(self._file, 'readinto', None)
+        if readinto is not None:
+            count = readinto(memoryview((c_char * length).from_address(buf)))
+            return count or 0
+        data = self._file.read(length)
+        memmove(buf, data, len(data))
+        return len(data)
+
+    def seek(self, offset):
+        self._file.seek(offset)
+        return 0
+
+    def close(self):
+        pass
+
+
+def open_media(instance, source, *options, mmap=False, samplerate=None):
+    """
+    Create a vlc.Media for a path, URL, bytes-like object, binary file
+    object or numpy array of samples (which requires samplerate). Returns
+    (media, callback_source), where callback_source is None for paths and
+    URLs and must otherwise be closed once the media is no longer played.
+    With mmap=True, local paths are served from a shared memory mapping.
+    """
+    if mmap:
+        callback_source = MappedSource(source)
+    elif _is_ndarray(source):
+        if samplerate is None:
+            raise ValueError('Playing samples requires a samplerate')
+        callback_source = SamplesSource(source, samplerate)
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        callback_source = MemorySource(source)
+    elif hasattr(source, 'read'):
+        callback_source = FileSource(source)
+    else:
+        return instance.media_new(source, *options), None
+    return callback_source.media_new(instance, *options), callback_source
+
+
+class PlayerPool(object):
+    """
+    Keeps a number of idle vlc.MediaPlayer objects ready to be handed out.
+
+    Players checked out of the pool borrow one of the idle media players
+    instead of constructing a new one, and give it back when they are
+    stopped. Returned media players are reset to their default volume, rate
+    and mute state before they are reused.
+    """
+
+    def __init__(self, size=4, instance_args=(), manager=None):
+        self.size = size
+        self._manager = manager or instances
+        self._instance_args = self._manager.key(instance_args)
+        self._instance = self._manager.acquire(self._instance_args)
+        self._lock = threading.Lock()
+        self._idle = [self._instance.media_player_new() for _ in range(size)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._idle)
+
+    @property
+    def instance(self):
+        return self._instance
+
+    def checkout(self, source):
+        return Player(source, pool=self)
+
+    def checkin(self, media_player):
+        hub = event_hub(media_player)
+        hub.clear()
+        hub.dispatcher = None
+        media_player.stop()
+        media_player.set_media(None)
+        media_player.audio_set_mute(False)
+        media_player.audio_set_volume(100)
+        media_player.set_rate(1.0)
+        with self._lock:
+            if self._instance is not None and len(self._idle) < self.size:
+                self._idle.append(media_player)
+                return
+        media_player.release()
+
+    def take(self):
+        with self._lock:
+            if self._instance is None:
+                raise ValueError('Player pool is closed')
+            if self._idle:
+                return self._idle.pop()
+        return self._instance.media_player_new()
+
+    def close(self):
+        with self._lock:
+            if self._instance is None:
+                return
+            idle, self._idle = self._idle, []
+            self._instance = None
+        for media_player in idle:
+            media_player.release()
+        self._manager.release(self._instance_args)
+
+
 class Player(object):
 
     State = vlc.State
 
-    def __init__(self, source):
+    def __init__(self, source, instance_args=(), manager=None, pool=None,
+                 dispatcher=None, mmap=False, samplerate=None):
         # Load from...
         #   "file://home/user/Music/audio.wav"
         #   "/home/user/Music/audio.wav"
         #   "relative/path/audio.wav"
         #   "relative/to/project/audio.wav"
         #   "http://website.com/audio.wav"
-        #   file-like object
-        #   bytes (python 2/3 fun!)
-        #   samples / samplerate (write to temp wav file?)
-
-        self._instance = vlc.Instance()
+        #   file-like object (binary, seekable or not)
+        #   bytes, bytearray or memoryview
+        #   memory-mapped local file (mmap=True)
+        #   numpy samples / samplerate (served as an in-memory wav)
 
-        self._pointer = vlc.Log_ptr()
-        @vlc.CallbackDecorators.LogCb
-        def cb(data, level, ctx, fmt, args):
-            print(data, level, ctx, fmt, args)
+        self._pool = pool
+        self._fanout = None
+        if pool is not None:
+            # Borrowed players share the pool's instance reference
+            self._manager = None
+            self._instance = pool.instance
+            self._player = pool.take()
+        else:
+            self._manager = manager or instances
+            self._instance_args = self._manager.key(instance_args)
+            self._instance = self._manager.acquire(self._instance_args)
+            self._player = self._instance.media_player_new()
 
-        self._cb = cb
-        self._instance.log_set(self._cb, self._pointer)
+        # Run event subscribers on a worker thread instead of libvlc's
+        if dispatcher is True:
+            dispatcher = default_dispatcher()
+        self._dispatcher = dispatcher
+        if dispatcher is not None:
+            event_hub(self._player).dispatcher = dispatcher
 
-        self._media = self._instance.media_new(source)
-        self._player = self._instance.media_player_new()
+        try:
+            self._media, self._source = open_media(
+                self._instance, source, mmap=mmap, samplerate=samplerate)
+        except Exception:
+            # Give back the media player and the instance reference
+            self._detach()
+            if self._manager is not None:
+                self._manager.release(self._instance_args)
+            self._instance = None
+            raise
         self._player.set_media(self._media)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._instance is None:
+            return
+        self._detach()
+        self._media.release()
+        if self._source is not None:
+            self._source.close()
+        if self._fanout is not None and self._fanout.monitor is not None:
+            self._fanout.monitor.close()
+        if self._manager is not None:
+            self._manager.release(self._instance_args)
+        self._instance = None
+
+    def _detach(self):
+        if self._player is None:
+            return
+        if self._pool is not None:
+            self._pool.checkin(self._player)
+        else:
+            self._player.stop()
+            self._player.release()
+        self._player = None
+
     def play(self):
+        if self._player is None:
+            # A pooled player gave its media player back on stop()
+            self._player = self._pool.take()
+            self._player.set_media(self._media)
+            if self._dispatcher is not None:
+                event_hub(self._player).dispatcher = self._dispatcher
         out = self._player.play()
         if out == -1:
             raise ValueError('Could not play source')
 
     def pause(self):
-        if self._player.can_pause():
+        if self._player is not None and self._player.can_pause():
             self._player.set_pause(1)
 
     def stop(self):
-        self._player.stop()
+        if self._pool is not None:
+            self._detach()
+        else:
+            self._player.stop()
 
     def seek(self, position):
-        if self._player.is_seekable():
+        if self._player is not None and self._player.is_seekable():
             i_time = int(position * 1000)
             self._player.set_time(i_time)
 
     def rate(self, rate):
-        self._player.set_rate(rate)
+        if self._player is not None:
+            self._player.set_rate(rate)
 
     def rewind(self):
         self.seek(0)
 
     @property
     def volume(self):
+        if self._player is None:
+            return -1
         return self._player.audio_get_volume()
 
     @volume.setter
     def volume(self, val):
+        if self._player is None:
+            raise ValueError('Player is stopped')
         out = self._player.audio_set_volume(val)
         if out == -1:
             raise ValueError('Volume out of range')
 
     @property
     def position(self):
+        if self._player is None:
+            return -1
         out = self._player.get_time()
         if out != -1:
             out /= 1000.0
@@ -124,7 +1177,2015 @@ class Player(object):
 
     @property
     def is_playing(self):
-        return self._player.is_playing()
+        return self._player is not None and bool(self._player.is_playing())
+
+    @property
+    def events(self):
+        """EventHub of the underlying media player."""
+        if self._player is None:
+            raise ValueError('Player is stopped')
+        return event_hub(self._player)
+
+    def tap(self, tap, monitor=True):
+        """
+        Feed the player's decoded audio to an AudioTap and return it. Call
+        it before play().
+
+        libvlc gives a player a single audio sink, so the first tap installs
+        a fan-out that every tap of the player shares, in the first tap's
+        float32 format. With monitor, decided by the first tap, the audio
+        is played on through a PcmOutput, otherwise the player is measured
+        but not heard.
+        """
+        if self._pool is not None:
+            raise ValueError('Taps need a player of its own, not a pooled one')
+        if self._fanout is None:
+            if tap.format != 'FL32':
+                raise ValueError('Player taps take float32 samples')
+            output = None
+            if monitor:
+                output = _Monitor(tap.rate, tap.channels,
+                                  instance_args=self._instance_args,
+                                  manager=self._manager)
+            self._fanout = _TapFanout(tap.rate, tap.channels, output)
+            self._fanout.install(self._player)
+        elif (tap.format, tap.rate, tap.channels) != (
+                'FL32', self._fanout.rate, self._fanout.channels):
+            raise ValueError('Every tap of a player must share one format')
+        self._fanout.taps.append(tap)
+        return tap
+
+    def meter(self, interval=0.05, callback=None, rate=44100, channels=2,
+              monitor=True):
+        """Install a LevelMeter on the player and return it, see tap()."""
+        return self.tap(LevelMeter(rate, channels, interval, callback), monitor)
+
+    def spectrum(self, size=2048, hop=512, bands=32, batch=4, rate=44100,
+                 channels=2, monitor=True):
+        """Install a SpectrumTap on the player and return it, see tap()."""
+        return self.tap(SpectrumTap(size, hop, bands, batch, rate, channels),
+                        monitor)
+
+
+class AsyncPlayer(Player):
+    """
+    Player that can be awaited from an asyncio event loop.
+
+    libvlc events are handed to the loop with call_soon_threadsafe(), so a
+    single loop can follow any number of players without polling threads.
+    """
+
+    STATE_EVENTS = {
+        vlc.State.Opening: EventType.MediaPlayerOpening,
+        vlc.State.Buffering: EventType.MediaPlayerBuffering,
+        vlc.State.Playing: EventType.MediaPlayerPlaying,
+        vlc.State.Paused: EventType.MediaPlayerPaused,
+        vlc.State.Stopped: EventType.MediaPlayerStopped,
+        vlc.State.Ended: EventType.MediaPlayerEndReached,
+        vlc.State.Error: EventType.MediaPlayerEncounteredError,
+    }
+
+    END_EVENTS = (
+        EventType.MediaPlayerEndReached,
+        EventType.MediaPlayerEncounteredError,
+        EventType.MediaPlayerStopped,
+    )
+
+    @property
+    def state(self):
+        if self._player is None:
+            return vlc.State.Stopped
+        return self._player.get_state()
+
+    async def wait_state(self, state):
+        """Wait until the player reaches the given vlc.State."""
+        eventtype = self.STATE_EVENTS[state]
+        import asyncio
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        hub = self.events
+        token = hub.subscribe(eventtype, _resolve_threadsafe, loop, future)
+        try:
+            if self.state != state:
+                await future
+        finally:
+            hub.unsubscribe(token)
+
+    async def play_until_end(self):
+        """
+        Start playback and wait for it to end, returning the EventRecord
+        that ended it.
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        hub = self.events
+        tokens = [hub.subscribe(eventtype, _resolve_threadsafe, loop, future)
+                  for eventtype in self.END_EVENTS]
+        try:
+            self.play()
+            record = await future
+        finally:
+            for token in tokens:
+                hub.unsubscribe(token)
+        if record.type == EventType.MediaPlayerEncounteredError:
+            raise ValueError('Could not play source')
+        return record
+
+    async def iter_events(self, *eventtypes):
+        """Yield an EventRecord for every event of the given types."""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        hub = self.events
+        tokens = [hub.subscribe(eventtype, _put_threadsafe, loop, queue)
+                  for eventtype in eventtypes]
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            for token in tokens:
+                hub.unsubscribe(token)
+
+    def __aiter__(self):
+        return self.iter_events(*set(self.STATE_EVENTS.values()))
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _resolve_threadsafe(record, loop, future):
+    loop.call_soon_threadsafe(_set_result, future, record)
+
+
+def _put_threadsafe(record, loop, queue):
+    loop.call_soon_threadsafe(queue.put_nowait, record)
+
+
+# libvlc sample format -> numpy dtype
+FORMATS = {
+    'FL32': 'float32',
+    'S16N': 'int16',
+}
+
+# libvlc sample format -> transcode codec with the same memory layout
+_ENDIAN = 'l' if sys.byteorder == 'little' else 'b'
+CODECS = {
+    'FL32': 'f32' + _ENDIAN,
+    'S16N': 's16' + _ENDIAN,
+}
+
+# Callbacks of the smem stream output, see modules/stream_out/smem.c
+_SmemPrerender = CFUNCTYPE(None, c_void_p, POINTER(c_void_p), c_size_t)
+_SmemPostrender = CFUNCTYPE(None, c_void_p, c_void_p, c_uint, c_uint, c_uint,
+                            c_uint, c_size_t, c_int64)
+
+
+def _require_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError('numpy is required to access decoded samples')
+        np = numpy
+    return np
+
+
+def _is_ndarray(obj):
+    # An array means numpy has already been imported, by someone
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and isinstance(obj, numpy.ndarray)
+
+
+class AudioTap(object):
+    """
+    Receives decoded PCM from a media player through audio_set_callbacks().
+
+    A media player with a tap installed no longer has an audio output: every
+    block of samples libvlc decodes is passed to write() instead, as the
+    address of `frames` interleaved frames of the configured format. It is
+    only valid until write() returns.
+
+    Alternatively, sout_options() routes the decoded audio through the smem
+    stream output. Without time synchronisation, smem decodes as fast as
+    the CPU allows, and libvlc decodes straight into the memory returned
+    by reserve().
+    """
+
+    def __init__(self, format='FL32', rate=44100, channels=2):
+        _require_numpy()
+        self.format = format
+        self.rate = rate
+        self.channels = channels
+        self.dtype = np.dtype(FORMATS[format])
+        self.frame_bytes = self.dtype.itemsize * channels
+        self._play_cb = vlc.CallbackDecorators.AudioPlayCb(self._play)
+        self._prerender_cb = _SmemPrerender(self._prerender)
+        self._postrender_cb = _SmemPostrender(self._postrender)
+        self._scratch = None
+
+    def install(self, media_player):
+        media_player.audio_set_callbacks(
+            self._play_cb, None, None, None, None, None)
+        media_player.audio_set_format(self.format, self.rate, self.channels)
+
+    def sout_options(self, realtime=False):
+        """Media options that send decoded audio to this tap through smem."""
+        transcode = 'transcode{vcodec=none,acodec=%s,channels=%d,samplerate=%d}' % (
+            CODECS[self.format], self.channels, self.rate)
+        smem = ('smem{audio-prerender-callback=%d,audio-postrender-callback=%d,'
+                'time-sync=%s}' % (
+                    cast(self._prerender_cb, c_void_p).value,
+                    cast(self._postrender_cb, c_void_p).value,
+                    'yes' if realtime else 'no'))
+        return (':sout=#%s:%s' % (transcode, smem), ':sout-keep', ':no-sout-video')
+
+    def reserve(self, size):
+        """Return the address of `size` bytes for libvlc to decode into."""
+        if self._scratch is None or sizeof(self._scratch) < size:
+            self._scratch = create_string_buffer(size)
+        return addressof(self._scratch)
+
+    def write(self, address, frames):
+        raise NotImplementedError
+
+    def _play(self, data, samples, count, pts):
+        try:
+            self.write(samples, count)
+        except Exception:
+            log.exception('Error in %s', type(self).__name__)
+
+    def _prerender(self, data, pp_buffer, size):
+        pp_buffer[0] = self.reserve(size)
+
+    def _postrender(self, data, buffer, channels, rate, nb_samples,
+                    bits_per_sample, size, pts):
+        try:
+            self.write(buffer, size // self.frame_bytes)
+        except Exception:
+            log.exception('Error in %s', type(self).__name__)
+
+
+class SampleBuffer(AudioTap):
+    """
+    AudioTap collecting every decoded frame into one growable array.
+
+    Blocks are copied straight from libvlc's buffer into preallocated
+    storage, which doubles whenever it fills up.
+    """
+
+    def __init__(self, format='FL32', rate=44100, channels=2, capacity=None):
+        AudioTap.__init__(self, format, rate, channels)
+        self.frames = 0
+        self._allocate(capacity or rate * 10)
+
+    def _allocate(self, capacity):
+        array = np.empty((capacity, self.channels), self.dtype)
+        if self.frames:
+            array[:self.frames] = self._array[:self.frames]
+        self._array = array
+        self._address = array.ctypes.data
+        self._capacity = capacity
+
+    def reserve(self, size):
+        # Decode in place at the end of the buffer
+        end = self.frames + -(-size // self.frame_bytes)
+        if end > self._capacity:
+            self._allocate(max(end, self._capacity * 2))
+        return self._address + self.frames * self.frame_bytes
+
+    def write(self, address, frames):
+        end = self.frames + frames
+        if end > self._capacity:
+            self._allocate(max(end, self._capacity * 2))
+        target = self._address + self.frames * self.frame_bytes
+        if address != target:
+            memmove(target, address, frames * self.frame_bytes)
+        self.frames = end
+
+    @property
+    def samples(self):
+        return self._array[:self.frames]
+
+    def trim(self):
+        """Shrink the storage to the frames written so far and return it."""
+        self._array.resize((self.frames, self.channels), refcheck=False)
+        self._address = self._array.ctypes.data
+        self._capacity = self.frames
+        return self._array
+
+
+class BlockQueue(AudioTap):
+    """
+    AudioTap cutting decoded audio into fixed-size blocks for a consumer.
+
+    Blocks come from a fixed set of preallocated arrays. When the consumer
+    falls `depth` blocks behind, write() blocks libvlc's thread until one is
+    released, which throttles decoding to the consumer's pace.
+    """
+
+    def __init__(self, format='FL32', rate=44100, channels=2,
+                 block_frames=4096, depth=8):
+        AudioTap.__init__(self, format, rate, channels)
+        self.block_frames = block_frames
+        self._free = queue.Queue()
+        self._full = queue.Queue()
+        # One block being filled and one held by the consumer, on top of
+        # the queued ones
+        for _ in range(depth + 2):
+            self._free.put(np.empty((block_frames, channels), self.dtype))
+        self._lock = threading.Lock()
+        self._block = None
+        self._filled = 0
+        self._closed = False
+
+    def write(self, address, frames):
+        frame_bytes = self.frame_bytes
+        done = 0
+        while done < frames:
+            spare = None
+            if self._block is None:
+                # Blocks while the consumer is behind, so outside the lock
+                spare = self._take()
+                if spare is None:
+                    return
+            with self._lock:
+                if self._closed:
+                    return
+                # finish() may have taken the block meanwhile, start another
+                if self._block is None:
+                    self._block = spare
+                block = self._block
+                if block is None:
+                    continue
+                count = min(frames - done, self.block_frames - self._filled)
+                memmove(block.ctypes.data + self._filled * frame_bytes,
+                        address + done * frame_bytes, count * frame_bytes)
+                self._filled += count
+                done += count
+                if self._filled == self.block_frames:
+                    self._full.put(block)
+                    self._block = None
+                    self._filled = 0
+
+    def _take(self):
+        while not self._closed:
+            try:
+                return self._free.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def get(self, timeout=None):
+        """Return the next full block, or None at the end of the stream."""
+        return self._full.get(timeout=timeout)
+
+    def release(self, block):
+        """Give a block returned by get() back for reuse."""
+        if block.base is not None:
+            block = block.base
+        self._free.put(block)
+
+    def finish(self):
+        """Queue the partially filled block, if any, and the end marker."""
+        with self._lock:
+            if self._block is not None and self._filled:
+                self._full.put(self._block[:self._filled])
+            self._block = None
+            self._filled = 0
+            self._full.put(None)
+
+    def close(self):
+        self._closed = True
+
+
+def float_frames(address, frames, channels):
+    """
+    Wrap interleaved float32 frames at an address as an array shaped
+    (frames, channels), without a copy. Unlike np.ctypeslib.as_array() on a
+    cast() pointer, nothing is left for the cyclic garbage collector, which
+    matters on libvlc's audio threads.
+    """
+    buffer = (c_float * (frames * channels)).from_address(address)
+    return np.frombuffer(buffer, np.float32).reshape(frames, channels)
+
+
+Levels = namedtuple('Levels', ['peak', 'rms'])
+
+
+class LevelMeter(AudioTap):
+    """
+    AudioTap measuring the peak and RMS level of each channel.
+
+    Levels are reduced straight from libvlc's buffer, and published every
+    `interval` seconds of decoded audio, as linear float32 Levels, to
+    `levels` and to callback(levels). The callback runs on libvlc's audio
+    thread and must return quickly.
+    """
+
+    def __init__(self, rate=44100, channels=2, interval=0.05, callback=None):
+        AudioTap.__init__(self, 'FL32', rate, channels)
+        self.interval = interval
+        self.callback = callback
+        self.levels = Levels(np.zeros(channels, np.float32),
+                             np.zeros(channels, np.float32))
+        self._window = max(1, int(rate * interval))
+        self._frames = 0
+        self._peak = np.zeros(channels, np.float32)
+        self._sum = np.zeros(channels, np.float32)
+        self._max = np.empty(channels, np.float32)
+        self._min = np.empty(channels, np.float32)
+        self._squares = np.empty(channels, np.float32)
+
+    def write(self, address, frames):
+        if not frames:
+            return
+        samples = float_frames(address, frames, self.channels)
+        np.max(samples, axis=0, out=self._max)
+        np.min(samples, axis=0, out=self._min)
+        np.maximum(self._peak, self._max, out=self._peak)
+        np.maximum(self._peak, np.negative(self._min, out=self._min),
+                   out=self._peak)
+        np.einsum('ij,ij->j', samples, samples, out=self._squares)
+        self._sum += self._squares
+        self._frames += frames
+        if self._frames >= self._window:
+            self._publish()
+
+    def _publish(self):
+        rms = np.sqrt(self._sum / self._frames).astype(np.float32)
+        self.levels = Levels(self._peak.copy(), rms)
+        self._peak.fill(0)
+        self._sum.fill(0)
+        self._frames = 0
+        if self.callback is not None:
+            self.callback(self.levels)
+
+
+def _rfft(frames, out):
+    try:
+        np.fft.rfft(frames, axis=1, out=out)
+    except TypeError:
+        # numpy < 2.0 has no out argument
+        out[...] = np.fft.rfft(frames, axis=1)
+
+
+class SpectrumTap(AudioTap):
+    """
+    AudioTap computing the magnitude spectrum of the decoded audio, mixed
+    down to mono.
+
+    A window of `size` frames advances by `hop` frames. Frames accumulate
+    until `batch` hops are available, then all the overlapping windows are
+    transformed with one real FFT call. Their magnitudes, averaged over the
+    batch, are available from latest() as `bands` log-spaced bands, or as
+    raw FFT bins when bands is None. A band holds the root of the summed
+    power of its bins, so a full scale sine reads 1.0 in either mode,
+    whatever the width of its band. Sample, FFT and band buffers are
+    allocated up front. Each block only creates a few short-lived array
+    views, which leave no reference cycles for the garbage collector.
+    """
+
+    def __init__(self, size=2048, hop=512, bands=32, batch=4, rate=44100,
+                 channels=2, fmin=20.0):
+        AudioTap.__init__(self, 'FL32', rate, channels)
+        if size % hop:
+            raise ValueError('Window size must be a multiple of the hop')
+        self.size = size
+        self.hop = hop
+        self.batch = batch
+        self.updates = 0
+        bins = size // 2 + 1
+        self._keep = size - hop
+        self._history = np.zeros(self._keep + batch * hop, np.float32)
+        self._filled = self._keep
+        self._frames = np.lib.stride_tricks.as_strided(
+            self._history, (batch, size), (hop * 4, 4), writeable=False)
+        self._window = np.hanning(size).astype(np.float32)
+        self._windowed = np.empty((batch, size), np.float32)
+        self._complex = np.empty((batch, bins), np.complex64)
+        self._magnitudes = np.empty((batch, bins), np.float32)
+
+        if bands is None:
+            self._bands = None
+            self.frequencies = np.fft.rfftfreq(size, 1.0 / rate)
+            self._latest = np.zeros(bins, np.float32)
+            # Peak bin of a full scale sine
+            self._scale = np.float32(2.0 / self._window.sum())
+        else:
+            edges = np.geomspace(fmin, rate / 2.0, bands + 1)
+            bin_of = np.fft.rfftfreq(size, 1.0 / rate)
+            matrix = np.zeros((bins, bands), np.float32)
+            for band in range(bands):
+                selected = (bin_of >= edges[band]) & (bin_of < edges[band + 1])
+                if not selected.any():
+                    # Narrow low bands take the nearest bin
+                    selected = np.argmin(abs(bin_of - edges[band]))
+                matrix[selected, band] = 1.0
+            self._bands = matrix
+            # Power of a full scale sine, summed over the bins it leaks into
+            self._scale = np.float32(
+                2.0 / np.sqrt(size * np.square(self._window, dtype=np.float64).sum()))
+            self.frequencies = np.sqrt(edges[:-1] * edges[1:])
+            self._latest = np.zeros(bands, np.float32)
+            self._result = np.empty((batch, bands), np.float32)
+        self._lock = threading.Lock()
+
+    def latest(self, out=None):
+        """Copy of the latest magnitudes, into `out` when given."""
+        with self._lock:
+            if out is None:
+                return self._latest.copy()
+            out[...] = self._latest
+            return out
+
+    def write(self, address, frames):
+        samples = float_frames(address, frames, self.channels)
+        done = 0
+        while done < frames:
+            count = min(frames - done, len(self._history) - self._filled)
+            np.mean(samples[done:done + count], axis=1,
+                    out=self._history[self._filled:self._filled + count])
+            self._filled += count
+            done += count
+            if self._filled == len(self._history):
+                self._transform()
+
+    def _transform(self):
+        np.multiply(self._frames, self._window, out=self._windowed)
+        _rfft(self._windowed, self._complex)
+        np.abs(self._complex, out=self._magnitudes)
+        with self._lock:
+            if self._bands is None:
+                np.mean(self._magnitudes, axis=0, out=self._latest)
+                self._latest *= self._scale
+            else:
+                np.square(self._magnitudes, out=self._magnitudes)
+                np.dot(self._magnitudes, self._bands, out=self._result)
+                np.sqrt(self._result, out=self._result)
+                np.mean(self._result, axis=0, out=self._latest)
+                self._latest *= self._scale
+            self.updates += self.batch
+        # Slide the overlap of the last window to the front
+        self._history[:self._keep] = self._history[len(self._history) - self._keep:]
+        self._filled = self._keep
+
+
+END_EVENTS = (
+    EventType.MediaPlayerEndReached,
+    EventType.MediaPlayerEncounteredError,
+)
+
+
+class _TapSession(object):
+    """
+    Media player on a shared instance that feeds a source through an
+    AudioTap, without an audio output. Offline sessions decode through smem
+    as fast as possible instead of following the playback clock.
+    """
+
+    def __init__(self, source, tap, instance_args=(), offline=False):
+        self.tap = tap
+        self._manager = instances
+        self._instance_args = self._manager.key(instance_args)
+        self._instance = self._manager.acquire(self._instance_args)
+        options = (':no-video',)
+        if offline:
+            options += tap.sout_options()
+        try:
+            self._media, self._source = open_media(self._instance, source,
+                                                   *options)
+        except Exception:
+            self._manager.release(self._instance_args)
+            raise
+        self._player = self._instance.media_player_new()
+        self._player.set_media(self._media)
+        if not offline:
+            tap.install(self._player)
+
+        self._done = threading.Event()
+        self.record = None
+        hub = event_hub(self._player)
+        for eventtype in END_EVENTS:
+            hub.subscribe(eventtype, self._finish)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def media_player(self):
+        return self._player
+
+    def start(self):
+        if self._player.play() == -1:
+            raise ValueError('Could not play source')
+
+    def wait(self, timeout=None):
+        """Wait for the end of the source, raising ValueError on error."""
+        if not self._done.wait(timeout):
+            return False
+        if self.record.type == EventType.MediaPlayerEncounteredError:
+            raise ValueError('Could not decode source')
+        return True
+
+    def close(self):
+        if self._player is None:
+            return
+        event_hub(self._player).clear()
+        self._player.stop()
+        self._player.release()
+        self._media.release()
+        if self._source is not None:
+            self._source.close()
+        self._manager.release(self._instance_args)
+        self._player = None
+
+    def _finish(self, record):
+        self.record = record
+        self._done.set()
+
+
+def decode(source, format='FL32', rate=44100, channels=2, instance_args=(),
+           timeout=None, offline=False):
+    """
+    Decode a source to an array of samples shaped (frames, channels).
+
+    Returns (samples, samplerate). Decoding is paced by libvlc's playback
+    clock, unless offline is set, in which case it runs as fast as the CPU
+    allows (not for live streams). A timeout in seconds stops decoding early
+    and returns what was decoded so far.
+    """
+    buffer = SampleBuffer(format, rate, channels)
+    with _TapSession(source, buffer, instance_args, offline) as session:
+        session.start()
+        session.wait(timeout)
+    return buffer.trim(), rate
+
+
+def stream_samples(source, block_frames=4096, format='FL32', rate=44100,
+                   channels=2, depth=8, instance_args=(), offline=False):
+    """
+    Decode a source incrementally, yielding arrays of block_frames frames
+    shaped (frames, channels). The last block may be shorter.
+
+    Memory use is constant. At most `depth` blocks are buffered ahead of
+    the consumer before decoding waits for it. Blocks are recycled, so a
+    block is only valid until the next one is requested. Copy it to keep it.
+    """
+    blocks = BlockQueue(format, rate, channels, block_frames, depth)
+    with _TapSession(source, blocks, instance_args, offline) as session:
+        for eventtype in END_EVENTS:
+            event_hub(session.media_player).subscribe(
+                eventtype, lambda record: blocks.finish())
+        session.start()
+        try:
+            previous = None
+            while True:
+                if previous is not None:
+                    blocks.release(previous)
+                previous = blocks.get()
+                if previous is None:
+                    break
+                yield previous
+        finally:
+            # Unblock libvlc's thread before the player is stopped
+            blocks.close()
+        session.wait(0)
+
+
+def cache_dir():
+    """Directory of soundroom's on-disk caches."""
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(root, 'soundroom')
+
+
+def media_metadata(media):
+    """
+    Return the metadata of a parsed vlc.Media as a JSON-serializable dict
+    with its duration in seconds (None if unknown), its Meta fields and
+    the description of its tracks.
+    """
+    duration = media.get_duration()
+    meta = {}
+    for value, name in sorted(vlc.Meta._enum_names_.items()):
+        text = media.get_meta(vlc.Meta(value))
+        if text:
+            meta[name] = text
+
+    # Media.tracks_get() is broken in the bindings, call libvlc directly
+    tracks = []
+    array = POINTER(vlc.MediaTrack)()
+    count = vlc.libvlc_media_tracks_get(media, byref(array))
+    if count:
+        pointers = cast(array, POINTER(POINTER(vlc.MediaTrack)))
+        for i in range(count):
+            track = pointers[i].contents
+            info = {
+                'type': str(track.type).split('.')[-1],
+                'codec': struct.pack('<I', track.codec).decode('latin-1'),
+                'bitrate': track.bitrate,
+                'language': vlc.bytes_to_str(track.language),
+                'description': vlc.bytes_to_str(track.description),
+            }
+            if track.type == vlc.TrackType.audio and track.audio:
+                info['channels'] = track.audio.contents.channels
+                info['rate'] = track.audio.contents.rate
+            tracks.append(info)
+        vlc.libvlc_media_tracks_release(array, count)
+
+    return {
+        'duration': duration / 1000.0 if duration >= 0 else None,
+        'meta': meta,
+        'tracks': tracks,
+    }
+
+
+class MetadataCache(object):
+    """
+    Persistent cache of media metadata, stored in SQLite.
+
+    Local files are keyed by (path, size, mtime), so an edited file is
+    parsed again. URLs are keyed by (url, etag), where the etag comes from
+    the caller. Misses are parsed synchronously with Media.parse() on a
+    shared instance and stored. The hits and misses counters track how
+    well the cache is doing.
+    """
+
+    def __init__(self, path=None, instance_args=()):
+        if path is None:
+            path = os.path.join(cache_dir(), 'metadata.sqlite')
+        if path != ':memory:' and not os.path.isdir(os.path.dirname(path) or '.'):
+            os.makedirs(os.path.dirname(path))
+        self.path = path
+        self.instance_args = instance_args
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        import sqlite3
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS metadata '
+                '(key TEXT PRIMARY KEY, source TEXT, record TEXT)')
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS metadata_source ON metadata (source)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def source_name(source):
+        if os.path.exists(source):
+            return os.path.realpath(source)
+        return source
+
+    @classmethod
+    def key(cls, source, etag=None):
+        name = cls.source_name(source)
+        if os.path.exists(name):
+            stat = os.stat(name)
+            return json.dumps([name, stat.st_size, stat.st_mtime])
+        return json.dumps([name, etag])
+
+    def lookup(self, source, etag=None):
+        """Return the cached record, or None without parsing on a miss."""
+        key = self.key(source, etag)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT record FROM metadata WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def get(self, source, etag=None):
+        """Return the metadata of a source, parsing it on a miss."""
+        record = self.lookup(source, etag)
+        if record is None:
+            record = self._parse(source)
+            self.put(source, record, etag)
+        return record
+
+    def put(self, source, record, etag=None):
+        key = self.key(source, etag)
+        with self._lock, self._db:
+            # Older entries for the same source are stale by definition
+            self._db.execute('DELETE FROM metadata WHERE source = ?',
+                             (self.source_name(source),))
+            self._db.execute(
+                'INSERT OR REPLACE INTO metadata VALUES (?, ?, ?)',
+                (key, self.source_name(source), json.dumps(record)))
+
+    def invalidate(self, source=None):
+        """Forget one source, or everything."""
+        with self._lock, self._db:
+            if source is None:
+                self._db.execute('DELETE FROM metadata')
+            else:
+                self._db.execute('DELETE FROM metadata WHERE source = ?',
+                                 (self.source_name(source),))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM metadata').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _parse(self, source):
+        instance = instances.acquire(self.instance_args)
+        try:
+            media = instance.media_new(source)
+            try:
+                media.parse()
+                return media_metadata(media)
+            finally:
+                media.release()
+        finally:
+            instances.release(self.instance_args)
+
+
+ScanResult = namedtuple('ScanResult', ['source', 'metadata', 'error'])
+
+# libvlc_media_parse_flag_t, MediaParseFlag in the bindings is garbled
+PARSE_LOCAL = 0x00
+PARSE_NETWORK = 0x01
+
+# libvlc_media_parsed_status_t values reporting an unparsed media
+_PARSE_SKIPPED = 1
+_PARSE_FAILED = 2
+_PARSE_TIMEOUT = 3
+
+_PARSE_ERRORS = {
+    _PARSE_SKIPPED: 'Parse skipped',
+    _PARSE_FAILED: 'Could not parse source',
+    _PARSE_TIMEOUT: 'Parse timed out',
+}
+
+# libvlc 3.0 added a timeout argument the bundled bindings don't declare
+_MediaParseWithOptions = CFUNCTYPE(c_int, c_void_p, c_int, c_int)
+_media_parse_with_options = None
+
+
+def parse_with_options(media, flags, timeout=-1):
+    """
+    Start an asynchronous parse of a vlc.Media. The timeout is in
+    milliseconds, -1 for libvlc's preparse-timeout option and 0 to wait
+    forever. Returns -1 when the parse could not be started.
+    """
+    global _media_parse_with_options
+    if _media_parse_with_options is None:
+        _media_parse_with_options = _MediaParseWithOptions(
+            ('libvlc_media_parse_with_options', vlc.load_lib()))
+    return _media_parse_with_options(media._as_parameter_, flags, timeout)
+
+
+def _parsed(record, results, source, media):
+    results.put((source, media, record.value))
+
+
+def scan(sources, concurrency=8, cache=None, instance_args=(), network=False,
+         processes=None, timeout=-1):
+    """
+    Parse the metadata of many sources, keeping up to `concurrency`
+    asynchronous parses in flight on one shared instance.
+
+    Yields a ScanResult for every source as its parse completes, with the
+    media_metadata() record, or the error message if it could not be
+    parsed. When a MetadataCache is given, cached sources are not parsed
+    and fresh results are stored in it. Each parse gives up after `timeout`
+    milliseconds, see parse_with_options().
+
+    With processes=N, uncached sources are sharded across N worker
+    processes, each scanning its shard on its own instance with the same
+    concurrency.
+    """
+    if processes:
+        return _scan_processes(sources, concurrency, cache, instance_args,
+                               network, processes, timeout)
+    return _scan(sources, concurrency, cache, instance_args, network, timeout)
+
+
+def _scan(sources, concurrency, cache, instance_args, network, timeout):
+    flag = PARSE_NETWORK if network else PARSE_LOCAL
+    instance = instances.acquire(instance_args)
+    results = queue.Queue()
+    in_flight = {}
+    sources = iter(sources)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(in_flight) < concurrency:
+                try:
+                    source = next(sources)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if cache is not None:
+                    metadata = cache.lookup(source)
+                    if metadata is not None:
+                        yield ScanResult(source, metadata, None)
+                        continue
+                media = instance.media_new(source)
+                event_hub(media).subscribe(
+                    EventType.MediaParsedChanged, _parsed, results, source, media)
+                if parse_with_options(media, flag, timeout) == -1:
+                    event_hub(media).clear()
+                    media.release()
+                    yield ScanResult(source, None, 'Could not parse source')
+                    continue
+                in_flight[id(media)] = media
+
+            if not in_flight:
+                break
+
+            source, media, status = results.get()
+            in_flight.pop(id(media))
+            event_hub(media).clear()
+            try:
+                if status in _PARSE_ERRORS:
+                    result = ScanResult(source, None, _PARSE_ERRORS[status])
+                else:
+                    result = ScanResult(source, media_metadata(media), None)
+            finally:
+                media.release()
+            if cache is not None and result.metadata is not None:
+                cache.put(source, result.metadata)
+            yield result
+    finally:
+        for media in in_flight.values():
+            event_hub(media).clear()
+            media.release()
+        instances.release(instance_args)
+
+
+# Results sent per message by scan workers
+_SCAN_BATCH = 64
+
+
+def _scan_worker(conn, sources, concurrency, instance_args, network, timeout):
+    """
+    Process entry point, streams ScanResult batches back through conn,
+    followed by None, or by an error message if the scan failed.
+    """
+    batch = []
+    error = None
+    try:
+        for result in _scan(sources, concurrency, None, instance_args, network,
+                            timeout):
+            batch.append(tuple(result))
+            if len(batch) >= _SCAN_BATCH:
+                conn.send(batch)
+                batch = []
+    except Exception as e:
+        log.exception('Scan worker failed')
+        error = 'Scan worker failed: %s' % e
+    finally:
+        conn.send(batch)
+        conn.send(error)
+        conn.close()
+        instances.shutdown()
+
+
+def _scan_processes(sources, concurrency, cache, instance_args, network,
+                    processes, timeout):
+    pending = []
+    for source in sources:
+        metadata = cache.lookup(source) if cache is not None else None
+        if metadata is not None:
+            yield ScanResult(source, metadata, None)
+        else:
+            pending.append(source)
+
+    import multiprocessing.connection
+
+    # Spawned rather than forked, libvlc's threads don't survive a fork
+    context = multiprocessing.get_context('spawn')
+    workers = {}
+    # Connection -> sources of the shard not reported yet, with counts
+    unreported = {}
+    try:
+        for i in range(min(processes, len(pending))):
+            parent, child = context.Pipe(duplex=False)
+            shard = pending[i::processes]
+            process = context.Process(
+                target=_scan_worker, name='soundroom-scan-%d' % i,
+                args=(child, shard, concurrency, instance_args, network,
+                      timeout))
+            process.daemon = True
+            process.start()
+            child.close()
+            workers[parent] = process
+            counts = unreported[parent] = {}
+            for source in shard:
+                counts[source] = counts.get(source, 0) + 1
+
+        while workers:
+            for conn in multiprocessing.connection.wait(list(workers)):
+                try:
+                    batch = conn.recv()
+                except EOFError:
+                    # The worker died without saying goodbye
+                    process = workers[conn]
+                    process.join()
+                    batch = 'Scan worker exited with code %s' % process.exitcode
+                if not isinstance(batch, list):
+                    workers.pop(conn).join()
+                    conn.close()
+                    # Whatever the shard did not report failed with it
+                    for source, count in unreported.pop(conn).items():
+                        for _ in range(count):
+                            yield ScanResult(source, None, batch or
+                                             'Scan worker did not report source')
+                    continue
+                counts = unreported[conn]
+                for result in batch:
+                    result = ScanResult(*result)
+                    counts[result.source] -= 1
+                    if not counts[result.source]:
+                        del counts[result.source]
+                    if cache is not None and result.metadata is not None:
+                        cache.put(result.source, result.metadata)
+                    yield result
+    finally:
+        for conn, process in workers.items():
+            process.terminate()
+            process.join()
+            conn.close()
+
+
+class Playlist(object):
+    """
+    Continuous playback of a list of sources through vlc.MediaListPlayer.
+
+    While an item plays, the next one is parsed in the background, so its
+    input has been probed and its metadata is ready before the switch. The
+    silence between the end of an item and the start of the next is
+    measured with libvlc_clock() and kept, in seconds, in `gaps`.
+    """
+
+    def __init__(self, sources=(), instance_args=(), manager=None, loop=False):
+        self._manager = manager or instances
+        self._instance_args = self._manager.key(instance_args)
+        self._instance = self._manager.acquire(self._instance_args)
+        self._medias = []
+        self._sources = []
+        self._list = self._instance.media_list_new()
+        for source in sources:
+            self.append(source)
+
+        self._player = self._instance.media_player_new()
+        self._list_player = self._instance.media_list_player_new()
+        self._list_player.set_media_player(self._player)
+        self._list_player.set_media_list(self._list)
+        if loop:
+            self._list_player.set_playback_mode(vlc.PlaybackMode.loop)
+
+        self.index = -1
+        self.gaps = deque(maxlen=1000)
+        self._ended_at = None
+        # Timing stays on libvlc's thread, parsing moves off it
+        hub = event_hub(self._player)
+        hub.subscribe(EventType.MediaPlayerEndReached, self._on_end)
+        hub.subscribe(EventType.MediaPlayerPlaying, self._on_playing)
+        list_hub = event_hub(self._list_player)
+        list_hub.dispatcher = default_dispatcher()
+        list_hub.subscribe(EventType.MediaListPlayerNextItemSet, self._on_next_item)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._medias)
+
+    def append(self, source):
+        media, callback_source = open_media(self._instance, source)
+        self._list.lock()
+        try:
+            if self._list.add_media(media) == -1:
+                raise ValueError('Playlist is read-only')
+        finally:
+            self._list.unlock()
+        self._medias.append(media)
+        self._sources.append(callback_source)
+
+    def play(self, index=None):
+        if index is None:
+            out = self._list_player.play()
+        else:
+            out = self._list_player.play_item_at_index(index)
+        if out == -1:
+            raise ValueError('Could not play playlist')
+
+    def pause(self):
+        self._list_player.pause()
+
+    def stop(self):
+        self._list_player.stop()
+
+    def next(self):
+        return self._list_player.next() != -1
+
+    def previous(self):
+        return self._list_player.previous() != -1
+
+    @property
+    def is_playing(self):
+        return bool(self._list_player.is_playing())
+
+    @property
+    def position(self):
+        out = self._player.get_time()
+        if out != -1:
+            out /= 1000.0
+        return out
+
+    @property
+    def events(self):
+        """EventHub of the media player playing the items."""
+        return event_hub(self._player)
+
+    def close(self):
+        if self._instance is None:
+            return
+        event_hub(self._list_player).clear()
+        event_hub(self._player).clear()
+        self._list_player.stop()
+        self._list_player.release()
+        self._player.release()
+        self._list.release()
+        for media, callback_source in zip(self._medias, self._sources):
+            media.release()
+            if callback_source is not None:
+                callback_source.close()
+        self._manager.release(self._instance_args)
+        self._instance = None
+
+    def prefetch(self, index):
+        """Parse an item ahead of playback, if it hasn't been already."""
+        if 0 <= index < len(self._medias):
+            media = self._medias[index]
+            if not media.is_parsed():
+                parse_with_options(media, PARSE_NETWORK)
+
+    def _on_next_item(self, record):
+        for index, media in enumerate(self._medias):
+            if media._as_parameter_.value == record.value:
+                self.index = index
+                self.prefetch(index + 1)
+                break
+
+    def _on_end(self, record):
+        self._ended_at = vlc.libvlc_clock()
+
+    def _on_playing(self, record):
+        if self._ended_at is not None:
+            self.gaps.append((vlc.libvlc_clock() - self._ended_at) / 1e6)
+            self._ended_at = None
+
+
+class FadeScheduler(object):
+    """
+    Runs timed calls for any number of crossfades from one thread.
+
+    Deadlines are absolute libvlc_clock() times in microseconds, so a late
+    step does not delay the ones after it.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition(threading.Lock())
+        self._thread = threading.Thread(target=self._run, name='soundroom-fades')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def call_at(self, deadline, func, *args):
+        """Call func(*args) at a libvlc_clock() deadline, return a handle."""
+        entry = [deadline, next(self._counter), func, args]
+        with self._cond:
+            heapq.heappush(self._heap, entry)
+            self._cond.notify()
+        return entry
+
+    def call_later(self, delay, func, *args):
+        return self.call_at(vlc.libvlc_clock() + int(delay * 1e6), func, *args)
+
+    def cancel(self, entry):
+        # Cancelled entries stay in the heap and are skipped
+        entry[2] = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                deadline = self._heap[0][0]
+                delay = deadline - vlc.libvlc_clock()
+                if delay > 0:
+                    self._cond.wait(delay / 1e6)
+                    continue
+                _, _, func, args = heapq.heappop(self._heap)
+            if func is None:
+                continue
+            try:
+                func(*args)
+            except Exception:
+                log.exception('Error in scheduled fade step')
+
+
+_fade_scheduler = None
+
+
+def fade_scheduler():
+    """Return the FadeScheduler shared by every CrossfadePlaylist."""
+    global _fade_scheduler
+    with _hub_lock:
+        if _fade_scheduler is None:
+            _fade_scheduler = FadeScheduler()
+        return _fade_scheduler
+
+
+class CrossfadePlaylist(object):
+    """
+    Plays a list of sources back to back, crossfading between consecutive
+    items over `fade` seconds.
+
+    Two media players alternate. The next item starts `fade` seconds before
+    the current one ends, according to get_length(), and the volumes follow
+    an equal-power curve updated every `step` seconds by the shared
+    FadeScheduler. Items are opened and stopped on the playlist's own
+    worker thread, so a slow input never holds up the fades of others.
+    """
+
+    def __init__(self, sources=(), fade=3.0, step=0.05, instance_args=(),
+                 manager=None, loop=False):
+        self.sources = list(sources)
+        self.fade = fade
+        self.step = step
+        self.loop = loop
+        self.volume = 100
+        self.index = -1
+        self._manager = manager or instances
+        self._instance_args = self._manager.key(instance_args)
+        self._instance = self._manager.acquire(self._instance_args)
+        self._scheduler = fade_scheduler()
+        self._lock = threading.RLock()
+        self._players = [self._instance.media_player_new() for _ in range(2)]
+        self._medias = [None, None]
+        self._active = 0
+        self._pending = None
+        self._generation = 0
+        self._tasks = queue.Queue()
+        self._worker = threading.Thread(target=self._run,
+                                        name='soundroom-crossfade')
+        self._worker.daemon = True
+        self._worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, source):
+        self.sources.append(source)
+
+    def play(self, index=0):
+        with self._lock:
+            self._cancel()
+            self._stop_slot(1 - self._active)
+            self.index = index
+            self._start(self._active, index, self.volume)
+            self._schedule_fade()
+
+    def stop(self):
+        with self._lock:
+            self._cancel()
+            for slot in range(2):
+                self._stop_slot(slot)
+            self.index = -1
+
+    def close(self):
+        if self._instance is None:
+            return
+        self.stop()
+        self._tasks.put(None)
+        self._worker.join()
+        for player in self._players:
+            player.release()
+        self._manager.release(self._instance_args)
+        self._instance = None
+
+    @property
+    def is_playing(self):
+        return bool(self._players[self._active].is_playing())
+
+    def _next_index(self):
+        index = self.index + 1
+        if index >= len(self.sources):
+            if not self.loop or not self.sources:
+                return None
+            index = 0
+        return index
+
+    def _start(self, slot, index, volume):
+        self._stop_slot(slot)
+        media, callback_source = open_media(self._instance, self.sources[index])
+        self._medias[slot] = (media, callback_source)
+        player = self._players[slot]
+        player.set_media(media)
+        player.audio_set_volume(volume)
+        if player.play() == -1:
+            raise ValueError('Could not play source')
+
+    def _stop_slot(self, slot):
+        self._players[slot].stop()
+        if self._medias[slot] is not None:
+            media, callback_source = self._medias[slot]
+            media.release()
+            if callback_source is not None:
+                callback_source.close()
+            self._medias[slot] = None
+
+    def _cancel(self):
+        # A step already taken off the scheduler's heap sees the new
+        # generation and does nothing
+        self._generation += 1
+        if self._pending is not None:
+            self._scheduler.cancel(self._pending)
+            self._pending = None
+
+    def _call_at(self, deadline, func, *args):
+        self._pending = self._scheduler.call_at(
+            deadline, self._step, self._generation, func, args)
+
+    def _call_soon(self, func, *args):
+        self._tasks.put((self._generation, func, args))
+
+    def _step(self, generation, func, args):
+        # Never wait for the lock on the scheduler thread every playlist
+        # shares, try again a step later
+        if not self._lock.acquire(False):
+            self._scheduler.call_later(self.step, self._step, generation,
+                                       func, args)
+            return
+        try:
+            if generation == self._generation:
+                func(*args)
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            generation, func, args = task
+            try:
+                with self._lock:
+                    if generation == self._generation:
+                        func(*args)
+            except Exception:
+                log.exception('Error in crossfade')
+
+    def _schedule_fade(self):
+        player = self._players[self._active]
+        length = player.get_length()
+        if length <= 0:
+            # The length is only known once the input is open
+            self._call_at(vlc.libvlc_clock() + 250000, self._schedule_fade)
+            return
+        remaining = max(0, length - max(0, player.get_time()) - int(self.fade * 1000))
+        self._call_at(vlc.libvlc_clock() + remaining * 1000,
+                      self._call_soon, self._begin_fade)
+
+    def _begin_fade(self):
+        index = self._next_index()
+        if index is None:
+            self._pending = None
+            return
+        self.index = index
+        self._start(1 - self._active, index, 0)
+        start = vlc.libvlc_clock()
+        self._call_at(start, self._ramp, start, 0)
+
+    def _ramp(self, start, count):
+        progress = min(1.0, (vlc.libvlc_clock() - start) / (self.fade * 1e6))
+        outgoing = self._players[self._active]
+        incoming = self._players[1 - self._active]
+        outgoing.audio_set_volume(int(round(self.volume * math.cos(progress * math.pi / 2))))
+        incoming.audio_set_volume(int(round(self.volume * math.sin(progress * math.pi / 2))))
+        if progress < 1.0:
+            deadline = start + int((count + 1) * self.step * 1e6)
+            self._call_at(deadline, self._ramp, start, count + 1)
+            return
+        self._call_soon(self._stop_slot, self._active)
+        self._active = 1 - self._active
+        self._schedule_fade()
+
+
+class PcmOutput(CallbackSource):
+    """
+    Endless float32 WAV stream played by one long-lived media player.
+
+    libvlc pulls audio as its buffers drain: every read renders the next
+    block by calling render(block) with a zeroed (block_frames, channels)
+    float32 array to fill in place. Nothing is opened or decoded per sound,
+    and latency is bounded by `caching` milliseconds of input buffering
+    plus the audio output's own buffer.
+    """
+
+    seekable = False
+
+    def __init__(self, render, rate=44100, channels=2, block_frames=512,
+                 caching=50, instance_args=(), manager=None):
+        _require_numpy()
+        CallbackSource.__init__(self)
+        self.rate = rate
+        self.channels = channels
+        self.block_frames = block_frames
+        self._render = render
+        dtype = np.dtype('<f4')
+        # The longest data chunk a RIFF header can describe. The player is
+        # restarted when it runs out, about 6 hours at 44.1kHz stereo
+        frames = (2 ** 32 - 256) // (dtype.itemsize * channels)
+        self._header = wav_header(frames, rate, channels, dtype)
+
+        self._manager = manager or instances
+        self._instance_args = self._manager.key(instance_args)
+        self._instance = self._manager.acquire(self._instance_args)
+        self._media = self.media_new(
+            self._instance, ':demux=wav', ':live-caching=%d' % caching)
+        self._player = self._instance.media_player_new()
+        self._player.set_media(self._media)
+        hub = event_hub(self._player)
+        hub.dispatcher = default_dispatcher()
+        hub.subscribe(EventType.MediaPlayerEndReached, self._restart)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def media_player(self):
+        return self._player
+
+    def start(self):
+        if self._player.play() == -1:
+            raise ValueError('Could not open audio output')
+
+    def open(self):
+        return _PcmStream(self._header, self._render, self.block_frames,
+                          self.channels)
+
+    def close(self):
+        if self._instance is None:
+            return
+        event_hub(self._player).clear()
+        self._player.stop()
+        self._player.release()
+        self._media.release()
+        CallbackSource.close(self)
+        self._manager.release(self._instance_args)
+        self._instance = None
+
+    def _restart(self, record):
+        if self._instance is not None:
+            self._player.stop()
+            self.start()
+
+
+class _PcmStream(object):
+
+    def __init__(self, header, render, block_frames, channels):
+        self._header = header
+        self._render = render
+        self._block = np.zeros((block_frames, channels), np.float32)
+        self._address = self._block.ctypes.data
+        self._nbytes = self._block.nbytes
+        self._pos = 0
+        self._offset = self._nbytes
+
+    def read(self, buf, length):
+        if self._pos < len(self._header):
+            count = min(length, len(self._header) - self._pos)
+            memmove(buf, self._header[self._pos:self._pos + count], count)
+            self._pos += count
+            return count
+        if self._offset == self._nbytes:
+            self._block.fill(0)
+            try:
+                self._render(self._block)
+            except Exception:
+                log.exception('Error rendering audio')
+                self._block.fill(0)
+            self._offset = 0
+        count = min(length, self._nbytes - self._offset)
+        memmove(buf, self._address + self._offset, count)
+        self._offset += count
+        return count
+
+    def close(self):
+        pass
+
+
+class _Monitor(object):
+    """
+    Plays audio handed over by an AudioTap through a PcmOutput, so a tapped
+    player is still heard. Frames go through a ring holding up to `latency`
+    seconds. The output plays silence when it catches up, and a full ring
+    drops its oldest frames.
+    """
+
+    def __init__(self, rate=44100, channels=2, latency=0.5, instance_args=(),
+                 manager=None):
+        _require_numpy()
+        self.channels = channels
+        self._ring = np.zeros((max(1, int(rate * latency)), channels), np.float32)
+        # Total frames written and read, the ring index is modulo its size
+        self._written = 0
+        self._read = 0
+        self._lock = threading.Lock()
+        self._output = PcmOutput(self._render, rate, channels,
+                                 instance_args=instance_args, manager=manager)
+        self._output.start()
+
+    def write(self, address, frames):
+        if not frames:
+            return
+        samples = float_frames(address, frames, self.channels)
+        size = len(self._ring)
+        samples = samples[-size:]
+        with self._lock:
+            start = self._written % size
+            count = min(len(samples), size - start)
+            self._ring[start:start + count] = samples[:count]
+            self._ring[:len(samples) - count] = samples[count:]
+            self._written += len(samples)
+            self._read = max(self._read, self._written - size)
+
+    def close(self):
+        self._output.close()
+
+    def _render(self, block):
+        size = len(self._ring)
+        with self._lock:
+            frames = min(len(block), self._written - self._read)
+            start = self._read % size
+            count = min(frames, size - start)
+            block[:count] = self._ring[start:start + count]
+            block[count:frames] = self._ring[:frames - count]
+            self._read += frames
+
+
+class _TapFanout(AudioTap):
+    """
+    The AudioTap installed on a Player, handing every block to each of its
+    taps and then to the monitor output, if any.
+    """
+
+    def __init__(self, rate, channels, monitor):
+        AudioTap.__init__(self, 'FL32', rate, channels)
+        self.taps = []
+        self.monitor = monitor
+
+    def write(self, address, frames):
+        for tap in self.taps:
+            try:
+                tap.write(address, frames)
+            except Exception:
+                log.exception('Error in %s', type(tap).__name__)
+        if self.monitor is not None:
+            self.monitor.write(address, frames)
+
+
+class _Voice(object):
+
+    __slots__ = ('id', 'samples', 'position', 'gain', 'loop')
+
+    def __init__(self, id, samples, gain, loop):
+        self.id = id
+        self.samples = samples
+        self.position = 0
+        self.gain = gain
+        self.loop = loop
+
+
+class SoundBank(object):
+    """
+    Plays short sounds with low latency and any amount of overlap.
+
+    Sounds are decoded into memory once by load(). play() only appends a
+    voice to the list mixed by a single, always open PcmOutput, so a trigger
+    costs no media, decoder or audio output. At most `max_voices` play at
+    once: past that, the oldest voice is stolen.
+    """
+
+    def __init__(self, max_voices=16, rate=44100, channels=2, block_frames=512,
+                 caching=50, instance_args=(), manager=None):
+        _require_numpy()
+        self.max_voices = max_voices
+        self.rate = rate
+        self.channels = channels
+        self.stolen = 0
+        self._instance_args = instance_args
+        self._sounds = {}
+        self._voices = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._scratch = np.empty((block_frames, channels), np.float32)
+        self._output = PcmOutput(self._render, rate, channels, block_frames,
+                                 caching, instance_args, manager)
+        self._output.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def load(self, name, source, offline=True):
+        """
+        Decode a source into the bank under `name`, as fast as possible
+        unless offline is False (needed for live streams).
+        """
+        samples, _ = decode(source, 'FL32', self.rate, self.channels,
+                            self._instance_args, offline=offline)
+        return self.add(name, samples)
+
+    def add(self, name, samples):
+        """Add already decoded samples, shaped (frames,) or (frames, channels)."""
+        samples = np.asarray(samples, np.float32)
+        if samples.ndim == 1:
+            samples = samples[:, np.newaxis]
+        if samples.ndim != 2 or samples.shape[1] not in (1, self.channels):
+            raise ValueError('Samples must be shaped (frames, %d)' % self.channels)
+        if not len(samples):
+            raise ValueError('Samples are empty')
+        if samples.shape[1] != self.channels:
+            samples = np.repeat(samples, self.channels, axis=1)
+        self._sounds[name] = np.ascontiguousarray(samples)
+        return self._sounds[name]
+
+    def remove(self, name):
+        del self._sounds[name]
+
+    def play(self, name, gain=1.0, loop=False):
+        """Start a voice playing sound `name` and return its id."""
+        samples = self._sounds[name]
+        with self._lock:
+            voice = _Voice(next(self._ids), samples, gain, loop)
+            if len(self._voices) >= self.max_voices:
+                self._voices.pop(0)
+                self.stolen += 1
+            self._voices.append(voice)
+            return voice.id
+
+    def stop(self, voice=None):
+        """Stop one voice by id, or every voice."""
+        with self._lock:
+            if voice is None:
+                del self._voices[:]
+            else:
+                self._voices = [v for v in self._voices if v.id != voice]
+
+    @property
+    def voices(self):
+        return len(self._voices)
+
+    def close(self):
+        self.stop()
+        self._output.close()
+
+    def _render(self, block):
+        frames = len(block)
+        with self._lock:
+            finished = False
+            for voice in self._voices:
+                done = 0
+                while done < frames:
+                    samples = voice.samples
+                    count = min(frames - done, len(samples) - voice.position)
+                    scratch = self._scratch[:count]
+                    np.multiply(samples[voice.position:voice.position + count],
+                                voice.gain, out=scratch)
+                    block[done:done + count] += scratch
+                    done += count
+                    voice.position += count
+                    if voice.position == len(samples):
+                        if not voice.loop:
+                            finished = True
+                            break
+                        voice.position = 0
+            if finished:
+                self._voices = [v for v in self._voices
+                                if v.loop or v.position < len(v.samples)]
+        np.clip(block, -1.0, 1.0, out=block)
+
+
+class MixerInput(object):
+    """
+    One source decoded into a Mixer through an AudioTap, with its own gain
+    and pan. Pan goes from -1.0 (left) to 1.0 (right) with an equal-power
+    law, so a centered input plays at -3dB on each side of a stereo mix.
+    """
+
+    def __init__(self, source, mixer, gain, pan, offline, depth):
+        self.source = source
+        self.gain = gain
+        self.pan = pan
+        self.underruns = 0
+        self._blocks = BlockQueue('FL32', mixer.rate, mixer.channels,
+                                  mixer.block_frames, depth)
+        self._gains = np.empty(mixer.channels, np.float32)
+        self._lock = threading.Lock()
+        self._session = _TapSession(source, self._blocks, mixer._instance_args,
+                                    offline)
+        hub = event_hub(self._session.media_player)
+        hub.dispatcher = default_dispatcher()
+        for eventtype in END_EVENTS:
+            hub.subscribe(eventtype, self._finish)
+
+    def gains(self):
+        """Per output channel gains, updated in place."""
+        if len(self._gains) == 2:
+            angle = (min(1.0, max(-1.0, self.pan)) + 1.0) * math.pi / 4
+            self._gains[0] = self.gain * math.cos(angle)
+            self._gains[1] = self.gain * math.sin(angle)
+        else:
+            self._gains.fill(self.gain)
+        return self._gains
+
+    def close(self):
+        # Unblock libvlc's thread before the player is stopped
+        self._blocks.close()
+        with self._lock:
+            self._session.close()
+
+    def _finish(self, record):
+        # Decoding is over, the mixer drains what is queued
+        self._blocks.finish()
+        with self._lock:
+            self._session.close()
+
+
+class Mixer(object):
+    """
+    Sums any number of decoded sources into one PcmOutput.
+
+    Each input is decoded by a media player without an audio output, in
+    fixed-size blocks, and the mix is rendered block by block with NumPy as
+    the output player asks for it. An input lagging behind the output
+    contributes silence for that block and counts an underrun. Offline
+    inputs decode ahead of the mix, as far as their queue depth allows.
+    """
+
+    def __init__(self, rate=44100, channels=2, block_frames=1024, caching=100,
+                 instance_args=(), manager=None):
+        _require_numpy()
+        self.rate = rate
+        self.channels = channels
+        self.block_frames = block_frames
+        self.volume = 1.0
+        self._instance_args = instance_args
+        self._inputs = []
+        self._lock = threading.Lock()
+        self._scratch = np.empty((block_frames, channels), np.float32)
+        self._output = PcmOutput(self._render, rate, channels, block_frames,
+                                 caching, instance_args, manager)
+        self._output.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def inputs(self):
+        return list(self._inputs)
+
+    def add(self, source, gain=1.0, pan=0.0, offline=False, depth=8):
+        """Start decoding a source into the mix and return its MixerInput."""
+        mixer_input = MixerInput(source, self, gain, pan, offline, depth)
+        with self._lock:
+            self._inputs = self._inputs + [mixer_input]
+        mixer_input._session.start()
+        return mixer_input
+
+    def remove(self, mixer_input):
+        with self._lock:
+            self._inputs = [i for i in self._inputs if i is not mixer_input]
+        mixer_input.close()
+
+    def close(self):
+        with self._lock:
+            inputs, self._inputs = self._inputs, []
+        for mixer_input in inputs:
+            mixer_input.close()
+        self._output.close()
+
+    def _render(self, block):
+        finished = []
+        for mixer_input in self._inputs:
+            try:
+                data = mixer_input._blocks.get(timeout=0)
+            except queue.Empty:
+                mixer_input.underruns += 1
+                continue
+            if data is None:
+                finished.append(mixer_input)
+                continue
+            count = len(data)
+            scratch = self._scratch[:count]
+            np.multiply(data, mixer_input.gains(), out=scratch)
+            block[:count] += scratch
+            mixer_input._blocks.release(data)
+        if self.volume != 1.0:
+            block *= self.volume
+        np.clip(block, -1.0, 1.0, out=block)
+        if finished:
+            with self._lock:
+                self._inputs = [i for i in self._inputs if i not in finished]
+
+
+class Waveform(object):
+    """
+    Min/max/RMS envelope pyramid of a source, one float32 array of
+    (min, max, rms) rows.
+
+    Level 0 has a bucket for every `bucket_frames` decoded mono frames and
+    every following level halves the previous one, down to a single bucket.
+    The first row of the array holds (bucket_frames, samplerate, length of
+    level 0), so a saved pyramid can be memory-mapped back as it is.
+    """
+
+    def __init__(self, data):
+        _require_numpy()
+        self.data = data
+        self.bucket_frames = int(data[0, 0])
+        self.rate = int(data[0, 1])
+        self.levels = []
+        offset = 1
+        length = int(data[0, 2])
+        while True:
+            self.levels.append(data[offset:offset + length])
+            offset += length
+            if length == 1:
+                break
+            length = -(-length // 2)
+
+    @classmethod
+    def load(cls, path):
+        _require_numpy()
+        return cls(np.load(path, mmap_mode='r'))
+
+    def save(self, path):
+        # Write then rename, so readers never map a partial file
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp, 'wb') as f:
+            np.save(f, self.data)
+        os.replace(temp, path)
+
+    @property
+    def duration(self):
+        """Length in seconds, rounded up to a whole bucket."""
+        return len(self.levels[0]) * self.bucket_frames / float(self.rate)
+
+    @classmethod
+    def build(cls, blocks, bucket_frames, rate):
+        """
+        Build a pyramid from an iterable of (frames, 1) arrays whose lengths
+        are multiples of bucket_frames, except for the last one.
+        """
+        _require_numpy()
+        chunks = []
+        for block in blocks:
+            samples = block[:, 0]
+            full = len(samples) - len(samples) % bucket_frames
+            buckets = samples[:full].reshape(-1, bucket_frames)
+            rows = np.empty((len(buckets) + (full < len(samples)), 3), np.float32)
+            rows[:len(buckets), 0] = buckets.min(axis=1)
+            rows[:len(buckets), 1] = buckets.max(axis=1)
+            # Mean squares until every level is reduced
+            rows[:len(buckets), 2] = np.einsum('ij,ij->i', buckets, buckets) / bucket_frames
+            if full < len(samples):
+                rest = samples[full:]
+                rows[-1] = rest.min(), rest.max(), np.dot(rest, rest) / len(rest)
+            chunks.append(rows)
+        if not chunks or not sum(len(chunk) for chunk in chunks):
+            raise ValueError('Source has no audio')
+
+        levels = [np.concatenate(chunks)]
+        while len(levels[-1]) > 1:
+            level = levels[-1]
+            if len(level) % 2:
+                level = np.concatenate((level, level[-1:]))
+            pairs = level.reshape(-1, 2, 3)
+            coarse = np.empty((len(pairs), 3), np.float32)
+            coarse[:, 0] = pairs[:, :, 0].min(axis=1)
+            coarse[:, 1] = pairs[:, :, 1].max(axis=1)
+            coarse[:, 2] = pairs[:, :, 2].mean(axis=1)
+            levels.append(coarse)
+        header = np.array([[bucket_frames, rate, len(levels[0])]], np.float32)
+        data = np.concatenate([header] + levels)
+        np.sqrt(data[1:, 2], out=data[1:, 2])
+        return cls(data)
+
+    def envelope(self, buckets):
+        """
+        Return (min, max, rms) rows for `buckets` equal slices of the
+        source, from the coarsest level that has enough resolution. Sources
+        shorter than `buckets` level 0 buckets get one row per bucket.
+        """
+        level = self.levels[0]
+        for candidate in self.levels:
+            if len(candidate) < buckets:
+                break
+            level = candidate
+        if len(level) <= buckets:
+            return np.array(level)
+        edges = np.arange(buckets) * len(level) // buckets
+        counts = np.diff(np.append(edges, len(level)))
+        out = np.empty((buckets, 3), np.float32)
+        out[:, 0] = np.minimum.reduceat(level[:, 0], edges)
+        out[:, 1] = np.maximum.reduceat(level[:, 1], edges)
+        out[:, 2] = np.sqrt(np.add.reduceat(np.square(level[:, 2]), edges) / counts)
+        return out
+
+
+def waveform_path(source, etag=None, bucket_frames=256, rate=44100):
+    """
+    Cache file of a source's Waveform. Paths and URLs are keyed like
+    MetadataCache entries, in-memory buffers and arrays by their content.
+    File objects can't be cached.
+    """
+    if isinstance(source, str):
+        key = MetadataCache.key(source, etag)
+    elif isinstance(source, (bytes, bytearray, memoryview)) or _is_ndarray(source):
+        if _is_ndarray(source):
+            source = _require_numpy().ascontiguousarray(source)
+        key = hashlib.sha1(memoryview(source).cast('B')).hexdigest()
+    else:
+        raise ValueError('Cannot cache the waveform of %r, pass cache=False'
+                         % type(source).__name__)
+    key = '%s:%d:%d' % (key, bucket_frames, rate)
+    name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npy'
+    return os.path.join(cache_dir(), 'waveforms', name)
+
+
+def load_waveform(source, etag=None, bucket_frames=256, rate=44100,
+                  cache=True, instance_args=()):
+    """
+    Return the Waveform of a source, from the cache when possible.
+
+    On a miss the source is decoded once, offline and in mono, and the
+    pyramid is saved to the cache unless cache is False.
+    """
+    _require_numpy()
+    path = waveform_path(source, etag, bucket_frames, rate) if cache else None
+    if path is not None and os.path.exists(path):
+        try:
+            return Waveform.load(path)
+        except (IOError, ValueError):
+            log.warning('Ignoring unreadable waveform cache %s', path)
+    blocks = stream_samples(source, block_frames=bucket_frames * 64,
+                            rate=rate, channels=1,
+                            instance_args=instance_args, offline=True)
+    result = Waveform.build(blocks, bucket_frames, rate)
+    if cache:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        result.save(path)
+    return result
+
+
+def waveform(source, buckets=1000, etag=None, bucket_frames=256, rate=44100,
+             cache=True, instance_args=()):
+    """
+    Return a (buckets, 3) float32 array of (min, max, rms) rows covering
+    the whole source. Later calls at any zoom level are served from the
+    cached pyramid without decoding again.
+    """
+    return load_waveform(source, etag, bucket_frames, rate, cache,
+                         instance_args).envelope(buckets)
 
 
 if __name__ == '__main__':
@@ -138,7 +3199,7 @@ if __name__ == '__main__':
     player.play()
     # player.rate(4.0)
     time.sleep(1)
-    print 'hi'
+    print('hi')
     # time.sleep(10)
     # player.pause()
     # time.sleep(2.0)